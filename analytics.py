@@ -0,0 +1,256 @@
+"""組織全体（部署別）の達成度分析。
+
+skill_answers 全体をページ単位で読み込み、シートごとに
+「ユーザー × 項目」のパック済みビット行列に変換する。集計はすべて
+scoring のマスクとの AND + popcount によるベクトル演算で行う。
+行列はプロセス内に保持し、保存時のフックで該当ユーザーの行だけを更新する
+（他プロセスでの保存は MAX_AGE ごとの再構築で取り込む）。再構築は全件を読むので
+バックグラウンドのスレッドで行い、その間は古い行列をそのまま使う。
+"""
+import logging
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import storage
+from catalog import LEVELS
+from scoring import ALL, get_index, popcount
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+MAX_AGE = 600.0
+
+# 各レベルの認定基準（達成率% + そのレベルの必須項目すべて達成）
+TIER_RULES = {"★": 70, "★★": 60, "★★★": 50}
+
+
+class OrgMatrix:
+    """ユーザー × 項目の達成ビット行列（シートごと）。"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.index = get_index(catalog)
+        self.user_ids = []
+        self.departments = []
+        self._rows = {}
+        self._bits = {name: np.zeros((0, si.cells.shape[-1]), dtype=np.uint8) for name, si in self.index.items()}
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.version = 0
+        self.built_at = time.monotonic()
+
+    def _row(self, user_id):
+        row = self._rows.get(user_id)
+        if row is None:
+            row = self._rows[user_id] = len(self.user_ids)
+            self.user_ids.append(user_id)
+            self.departments.append("")
+            for name, bits in self._bits.items():
+                if row >= len(bits):  # 容量を倍々で確保する
+                    grown = np.zeros((max(16, 2 * len(bits)), bits.shape[1]), dtype=np.uint8)
+                    grown[:len(bits)] = bits
+                    self._bits[name] = grown
+        return row
+
+    def set_answers(self, user_id, sheet, answers):
+        si = self.index.get(sheet)
+        if si is None:
+            return
+        bits = si.pack(answers)
+        with self._lock:
+            row = self._row(user_id)  # 行の確保で配列が差し替わることがあるので先に取る
+            self._bits[sheet][row] = bits
+            self.version += 1
+
+    def set_department(self, user_id, department):
+        with self._lock:
+            self.departments[self._row(user_id)] = department or ""
+            self.version += 1
+
+    def department_names(self):
+        return sorted({d for d in self.departments if d})
+
+    def stats(self, department=None) -> "CohortStats":
+        # 同じ版の行列に対する集計は再利用する
+        with self._lock:
+            cached = self._stats.get(department)
+            if cached is not None and cached[0] == self.version:
+                return cached[1]
+            n = len(self.user_ids)
+            if department:
+                rows = np.flatnonzero(np.array(self.departments, dtype=object) == department)
+            else:
+                rows = np.arange(n)
+            bits = {name: b[:n][rows] for name, b in self._bits.items()}
+            version = self.version
+        result = CohortStats(self.catalog, self.index, bits)
+        with self._lock:
+            self._stats[department] = (version, result)
+        return result
+
+
+class CohortStats:
+    """集団の集計結果。配列はすべて (ユーザー, レベル, カテゴリ) 形式で持つ。"""
+
+    def __init__(self, catalog, index, bits_by_sheet):
+        self.catalog = catalog
+        self.index = index
+        self.bits = bits_by_sheet
+        self.user_count = len(next(iter(bits_by_sheet.values()))) if bits_by_sheet else 0
+        self.achieved = {}
+        self.required_achieved = {}
+        for name, si in index.items():
+            b = bits_by_sheet[name][:, None, None, :]
+            self.achieved[name] = popcount(b & si.cells[None])
+            self.required_achieved[name] = popcount(b & si.required_cells[None])
+
+    def _level_axis(self, array, level):
+        return array.sum(axis=1) if level == ALL else array[:, LEVELS.index(level)]
+
+    def _user_totals(self, level):
+        # ユーザーごとの (達成件数, 必須達成件数) と 全体の (合計件数, 必須合計件数)
+        achieved = np.zeros(self.user_count, dtype=np.int64)
+        required_achieved = np.zeros(self.user_count, dtype=np.int64)
+        total = required_total = 0
+        for name, si in self.index.items():
+            achieved += self._level_axis(self.achieved[name], level).sum(axis=-1)
+            required_achieved += self._level_axis(self.required_achieved[name], level).sum(axis=-1)
+            levels = si.total.sum(axis=0) if level == ALL else si.total[LEVELS.index(level)]
+            required_levels = si.required_total.sum(axis=0) if level == ALL else si.required_total[LEVELS.index(level)]
+            total += int(levels.sum())
+            required_total += int(required_levels.sum())
+        return achieved, required_achieved, total, required_total
+
+    def progress(self, level=ALL) -> np.ndarray:
+        # ユーザーごとの達成率（%）
+        achieved, _, total, _ = self._user_totals(level)
+        return achieved * 100.0 / total if total else np.zeros(self.user_count)
+
+    def progress_histogram(self, level=ALL, bins=10) -> pd.Series:
+        edges = np.linspace(0, 100, bins + 1)
+        counts, _ = np.histogram(self.progress(level), bins=edges)
+        labels = [f"{int(lo)}-{int(hi)}%" for lo, hi in zip(edges[:-1], edges[1:])]
+        return pd.Series(counts, index=labels, name="人数")
+
+    def tier_counts(self) -> dict:
+        # { レベル: 認定基準を満たす人数 }
+        result = {}
+        for level, threshold in TIER_RULES.items():
+            achieved, required_achieved, total, required_total = self._user_totals(level)
+            if total == 0:
+                result[level] = 0
+                continue
+            qualified = (achieved * 100.0 / total >= threshold) & (required_achieved == required_total)
+            result[level] = int(qualified.sum())
+        return result
+
+    def category_rates(self, level=ALL) -> pd.DataFrame:
+        # シート・スキルカテゴリごとの平均達成率（低い順）
+        rows = []
+        for name, si in self.index.items():
+            achieved = self._level_axis(self.achieved[name], level).sum(axis=0)
+            total = si.total.sum(axis=0) if level == ALL else si.total[LEVELS.index(level)]
+            for cat, a, t in zip(si.categories, achieved, total):
+                if t > 0 and self.user_count:
+                    rows.append((name, cat, a * 100.0 / (t * self.user_count)))
+        df = pd.DataFrame(rows, columns=["シート", "スキルカテゴリ", "平均達成率(%)"])
+        return df.sort_values("平均達成率(%)", kind="stable").reset_index(drop=True)
+
+    def item_rates(self, sheet, level=ALL) -> pd.DataFrame:
+        # 項目ごとの達成率（低い順）
+        si = self.index[sheet]
+        achieved = np.unpackbits(self.bits[sheet], axis=1, count=si.size).sum(axis=0)
+        df = self.catalog.frame(sheet)[["NO", "スキルカテゴリ", "スキルレベル", "チェック項目", "必須"]].copy()
+        df["達成率(%)"] = achieved * 100.0 / self.user_count if self.user_count else 0.0
+        if level != ALL:
+            df = df[df["スキルレベル"] == level]
+        return df.sort_values("達成率(%)", kind="stable").reset_index(drop=True)
+
+
+def build_org_matrix(db, catalog_version, page_size=PAGE_SIZE) -> OrgMatrix:
+    # catalog_version: catalog_registry.CatalogVersion（回答はこの版の NO に読み替えて載せる）
+    matrix = OrgMatrix(catalog_version.catalog)
+    for data in db.iter_answers(page_size):
+        if data.get("user_id") and data.get("sheet"):
+            matrix.set_answers(data["user_id"], data["sheet"], storage.doc_answers(data, catalog_version))
+    for user_id, data in db.iter_users(page_size, fields=["department"]):
+        matrix.set_department(user_id, data.get("department", ""))
+    return matrix
+
+
+# --- プロセス共有の行列（保存フックで差分更新、再構築はバックグラウンド） ---
+_lock = threading.Lock()
+_matrix = None
+# 構築中の (スレッド, カタログ, 構築中に保存された [(user_id, sheet, 回答)])。保存は構築後に当て直す
+_building = None
+
+
+def _build(db, catalog_version):
+    global _matrix, _building
+    try:
+        matrix = build_org_matrix(db, catalog_version)
+    except Exception:
+        logger.exception("failed to build the org matrix")
+        matrix = None
+    with _lock:
+        if matrix is not None:
+            for user_id, sheet, answers in _building[2]:
+                matrix.set_answers(user_id, sheet, answers)
+            _matrix = matrix
+        _building = None
+
+
+def refresh_async(db, catalog_version) -> threading.Thread:
+    # 行列の再構築をバックグラウンドで始める（構築中ならそのスレッドを返す）
+    global _building
+    with _lock:
+        if _building is None:
+            thread = threading.Thread(target=_build, args=(db, catalog_version), daemon=True)
+            _building = (thread, catalog_version.catalog, [])
+            thread.start()
+        return _building[0]
+
+
+def latest_org_matrix(db, catalog_version, max_age=MAX_AGE):
+    # 待たずに手元の行列を返す（まだない・版が違うときは None）。
+    # ない・古い・版が違うときはバックグラウンドで作り直しを始める
+    matrix = _matrix
+    if matrix is not None and matrix.catalog is not catalog_version.catalog:
+        matrix = None
+    if matrix is None or time.monotonic() - matrix.built_at >= max_age:
+        refresh_async(db, catalog_version)
+    return matrix
+
+
+def get_org_matrix(db, catalog_version, max_age=MAX_AGE) -> OrgMatrix:
+    # 古くなった行列はそのまま返して裏で作り直す。まだない（版が変わった）ときだけ構築を待つ
+    global _matrix
+    matrix = latest_org_matrix(db, catalog_version, max_age)
+    for _ in range(2):  # 別の版を構築中だったら、その後に始まるこの版の構築も待つ
+        if matrix is not None:
+            return matrix
+        refresh_async(db, catalog_version).join()
+        matrix = latest_org_matrix(db, catalog_version, max_age)
+    if matrix is None:
+        # バックグラウンドの構築に失敗した（エラーは呼び出し側に返す）
+        matrix = build_org_matrix(db, catalog_version)
+        with _lock:
+            _matrix = matrix
+    return matrix
+
+
+def _on_save(db, user_id, sheet, answers, changes, catalog_version):
+    # 別の版で保存された回答は NO が違うので載せない（版の切り替え後の再構築で取り込む）
+    if catalog_version is None:
+        return
+    with _lock:
+        matrix = _matrix
+        if _building is not None and _building[1] is catalog_version.catalog:
+            _building[2].append((user_id, sheet, answers))
+    if matrix is not None and matrix.catalog is catalog_version.catalog:
+        matrix.set_answers(user_id, sheet, answers)
+
+storage.save_listeners.append(_on_save)
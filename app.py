@@ -1,33 +1,35 @@
 import streamlit as st
 import pandas as pd
-from datetime import datetime
-import matplotlib.pyplot as plt
-import plotly.express as px
-import matplotlib
-import firebase_admin
-from firebase_admin import credentials, firestore
 import hashlib
-import secrets
-import matplotlib.font_manager as fm
+import metrics
+from analytics import get_org_matrix, latest_org_matrix
+from catalog_registry import CATALOG_DIR, UnknownCatalogVersion, get_registry
+from charts import donut_chart_image, radar_chart_spec
+from history import fetch_rollups, trend_frame
+from recommend import get_peer_index, recommend
+from resources import get_backend, warm_up_async
+from scoring import evaluate
+from storage import (create_session, enable_write_behind, fetch_user_answers, fetch_user_profile,
+                     remember_user_profile, revoke_session, save_user_answers, validate_session)
 
 # ✅ ページ幅を広げる設定
 st.set_page_config(page_title="スキルチェックアプリ", layout="wide")
 
-# 日本語フォントを明示的に指定
-# --- フォント設定（ローカルフォント読み込み） ---
-font_path = "fonts/ipaexg.ttf"
-fontprop = fm.FontProperties(fname=font_path)
-matplotlib.rcParams["font.family"] = fontprop.get_name()
-matplotlib.rcParams["axes.unicode_minus"] = False
+# --- 計測（secrets の metrics_enabled = true で有効。metrics_log_reruns で再実行ごとにログ出力） ---
+metrics.configure(st.secrets.get("metrics_enabled", False), st.secrets.get("metrics_log_reruns", False))
+metrics.begin_rerun()
 
-# ---- DB接続 ----
-firebase_config = dict(st.secrets["firebase"])
-cred = credentials.Certificate(firebase_config)
+# ---- DB接続（バックエンドはプロセスで1つだけ作って共有する） ----
+# secrets の storage_backend = "sqlite" で Firestore の代わりにローカルの SQLite（sqlite_path）を使う
+db = get_backend(st.secrets)
 
-if not firebase_admin._apps:  # 既存アプリがなければ初期化
-    firebase_admin.initialize_app(cred)
+# 日本語フォント・グラフライブラリ・カタログの準備は、ログイン画面を出している間に
+# バックグラウンドで済ませておく（プロセスで1回だけ。フォントは fonts/ipaexg.ttf）
+catalog_dir = st.secrets.get("catalog_dir", CATALOG_DIR)
+warm_up_async(settings=st.secrets, catalog_dir=catalog_dir)
 
-db = firestore.client()
+# 連続保存をまとめて書き込む場合は secrets に write_behind_delay（秒）を設定する
+enable_write_behind(db, float(st.secrets.get("write_behind_delay", 0)))
 
 # ----パスワードをハッシュ化 ---
 def hash_password(password: str) -> str:
@@ -40,32 +42,25 @@ if "user_id" not in st.session_state:
     st.session_state.user_id = ""
 if "mode" not in st.session_state:
     st.session_state.mode = "save"  # 初期は保存モード
-if "all_answers_cache" not in st.session_state:
-    st.session_state.all_answers_cache = {}
 
-# --- Excel 読み込みキャッシュ ---
-file_path = "skillcheck_ver5.00_simple.xlsx"
-sheets = ["ビジネス力","データサイエンス力", "データエンジニアリング力"]
-
-def load_data(sheet_name):
-    df = pd.read_excel(file_path, sheet_name=sheet_name, skiprows=2)
-    df = df[["NO","スキルカテゴリ","サブカテゴリ","スキルレベル","チェック項目","必須"]]
-    df = df.dropna(subset=["チェック項目"])
-    df["必須"] = df["必須"].fillna(False).astype(bool)
-    return df
-
-sheet_data_cache = {sheet: load_data(sheet) for sheet in sheets}
+# --- チェックシート（カタログ） ---
+# catalog_dir 内の skillcheck_ver*.xlsx の最新版を使う。新しい版は監視スレッドが取り込んで差し替える。
+# この再実行の間は、ここで取得した版のまま使う（catalog_registry.py）
+with metrics.span("catalog.load"):
+    catalog_version = get_registry(catalog_dir).active
+catalog = catalog_version.catalog
+sheets = catalog.sheet_names
 
-# --- ページロード時にURLパラメータからトークンを取得して検証 ---
 # --- ページロード時にURLパラメータからトークンを取得して検証 ---
 query_params = st.query_params
 if "token" in query_params and query_params["token"]:
     token = query_params["token"]
-    # Firestoreでトークンを検証
-    token_docs = db.collection("sessions").where("token", "==", token).get()
-    if token_docs:
+    # トークンを検証（プロセス内キャッシュ → sessions/{hash(token)} の直接取得）
+    with metrics.span("session.validate"):
+        token_user_id = validate_session(db, token)
+    if token_user_id:
         st.session_state.logged_in = True
-        st.session_state.user_id = token_docs[0].to_dict()["user_id"]
+        st.session_state.user_id = token_user_id
     else:
         st.session_state.logged_in = False
         st.session_state.user_id = ""
@@ -80,21 +75,15 @@ if not st.session_state.get("logged_in", False):
     password_input = st.text_input("パスワード", type="password", key="login_pass")
 
     if st.button("ログイン", key="login_btn"):
-        user_doc = db.collection("users").document(username_input).get()
-        if user_doc.exists and user_doc.to_dict().get("password") == hash_password(password_input):
+        user_doc = db.get_user(username_input)
+        if user_doc is not None and user_doc.get("password") == hash_password(password_input):
             # ログイン成功
             st.session_state.logged_in = True
             st.session_state.user_id = username_input
+            remember_user_profile(username_input, user_doc)
 
-            # ランダムトークン生成
-            token = secrets.token_hex(16)
-
-            # Firestoreにトークン保存（有効期限を追加してもOK）
-            db.collection("sessions").document(username_input).set({
-                "user_id": username_input,
-                "token": token,
-                "created_at": datetime.now()
-            })
+            # ランダムトークンを生成して保存（有効期限は created_at から SESSION_TTL）
+            token = create_session(db, username_input)
 
             # URLパラメータにトークンを設定
             st.query_params.clear()
@@ -110,38 +99,16 @@ if not st.session_state.get("logged_in", False):
 # --- メイン画面 ---
 if st.session_state.get("logged_in", False):
 
-    # ---- Firestore 保存処理（1ドキュメントにまとめる）----
+    # ---- 保存処理（1ドキュメントにまとめる）----
+    @metrics.timed("answers.save")
     def save_user_sheet_answers(user_id, sheet, answers_dict):
-        doc_id = f"{user_id}_{sheet}"
-        db.collection("skill_answers").document(doc_id).set({
-            "user_id": user_id,
-            "sheet": sheet,
-            "answers": answers_dict,  # { no: achieved }
-            "updated_at": datetime.now()
-        })
-        # キャッシュを更新
-        if user_id not in st.session_state.all_answers_cache:
-            st.session_state.all_answers_cache[user_id] = {}
-        st.session_state.all_answers_cache[user_id][sheet] = answers_dict
-
-    # ---- Firestore 一括取得（キャッシュ付き） ----
-    def get_user_sheet_answers_cached(user_id, sheet):
-        if user_id not in st.session_state.all_answers_cache:
-            st.session_state.all_answers_cache[user_id] = {}
-
-        if sheet not in st.session_state.all_answers_cache[user_id]:
-            doc_id = f"{user_id}_{sheet}"
-            doc = db.collection("skill_answers").document(doc_id).get()
-            if doc.exists:
-                st.session_state.all_answers_cache[user_id][sheet] = doc.to_dict().get("answers", {})
-            else:
-                st.session_state.all_answers_cache[user_id][sheet] = {}
-        return st.session_state.all_answers_cache[user_id][sheet]
+        # 変更のあった項目だけを書き込む（表示外の項目の回答は保持される）
+        return save_user_answers(db, user_id, sheet, answers_dict, catalog_version)
 
-    # --- ユーザー回答取得関数 ---
-    def get_user_answers(user_id, sheet, filtered_ids):
-        all_answers = get_user_sheet_answers_cached(user_id, sheet)
-        return {no: all_answers.get(str(no), False) for no in filtered_ids}
+    # ---- 一括取得（全シートを1回で取得し、プロセス共有キャッシュに保持） ----
+    @metrics.timed("answers.fetch")
+    def get_user_sheet_answers_cached(user_id, sheet):
+        return fetch_user_answers(db, user_id, sheets, catalog_version)[sheet]
 
     # --- サイドバー ---
     st.sidebar.title("ユーザー設定")
@@ -150,7 +117,7 @@ if st.session_state.get("logged_in", False):
     st.sidebar.title("チェックシート設定")
     check_sheet = st.sidebar.selectbox("シートを選択", sheets)
 
-    temp_df = sheet_data_cache[check_sheet]
+    temp_df = catalog.frame(check_sheet)  # カタログの共有データ（書き換えない）
     categories = temp_df["スキルカテゴリ"].dropna().unique().tolist()
 
     level_filter = st.sidebar.multiselect("スキルレベルで絞り込み", ["★","★★","★★★"], default=["★"])
@@ -171,38 +138,88 @@ if st.session_state.get("logged_in", False):
         if st.button("→ あなたの達成状況を確認する"):
             st.session_state.mode = "analyze"
             st.rerun()
-    elif st.session_state.mode == "analyze":
+    elif st.session_state.mode in ("analyze", "org"):
         if st.button("← スキルチェックを保存する"):
             st.session_state.mode = "save"
             st.rerun()
 
+    # 組織分析は users ドキュメントの role が manager / admin のユーザーのみ
+    user_role = fetch_user_profile(db, st.session_state.user_id).get("role")
+    is_manager = user_role in ("manager", "admin")
+    if st.session_state.mode == "org" and not is_manager:
+        st.session_state.mode = "save"
+    if is_manager and st.session_state.mode != "org":
+        st.sidebar.markdown("---")
+        if st.sidebar.button("🏢 組織分析", key="org_btn"):
+            st.session_state.mode = "org"
+            st.rerun()
+
     st.sidebar.markdown("---")
     if st.sidebar.button("🔓ログアウト", key="logout_btn"):
+        if st.query_params.get("token"):
+            revoke_session(db, st.query_params["token"])
         st.session_state.logged_in = False
         st.session_state.user_id = ""
         st.query_params.clear()
         st.rerun()  # ✅ ここも変更！
 
+    # --- 計測結果（admin のみ、計測が有効なときだけ表示） ---
+    if metrics.enabled and user_role == "admin":
+        with st.sidebar.expander("⏱ パフォーマンス計測"):
+            st.dataframe(pd.DataFrame(metrics.snapshot()), hide_index=True)
+            st.download_button("メトリクスをダウンロード", metrics.metrics_text(),
+                               file_name="skillcheck_metrics.txt", mime="text/plain")
+
     # --- 保存モード ---
     if st.session_state.mode == "save":
         st.title(f"スキルチェック : {check_sheet}")
         all_answers = get_user_sheet_answers_cached(st.session_state.user_id, check_sheet)
 
-        answer = {}
-        for _, row in df.iterrows():
-            qid = str(row["NO"])
-            default_value = all_answers.get(qid, False)
-            label_prefix = "【必須】" if row["必須"] else ""
-            label_text = f"{label_prefix}{row['チェック項目']}-{row['スキルレベル']}-"
-            answer[qid] = st.checkbox(label_text, key=qid, value=default_value)
+        # 項目数が多いときは表形式（1ウィジェット）で編集すると再実行のコストが一定になる
+        edit_style = st.radio("表示形式", ["チェックボックス", "一括編集（表）"], horizontal=True, key="edit_style")
+
+        # ラベル・初期値は行ごとではなく列単位でまとめて作る
+        qids = df["NO"].astype(str)
+        labels = df["必須"].map({True: "【必須】", False: ""}) + df["チェック項目"] + "-" + df["スキルレベル"] + "-"
+        defaults = pd.Series(all_answers.lookup(qids), index=qids.index)
+
+        if edit_style == "一括編集（表）":
+            grid = pd.DataFrame({
+                "達成": defaults.to_numpy(),
+                "チェック項目": labels.to_numpy(),
+                "スキルカテゴリ": df["スキルカテゴリ"].to_numpy(),
+            })
+            # シート・絞り込みが変わったら別の表として扱う（編集内容が別の行に当たらないように）
+            grid_key = hashlib.md5(",".join(qids).encode()).hexdigest()[:12]
+            edited = st.data_editor(
+                grid,
+                key=f"grid_{check_sheet}_{grid_key}",
+                hide_index=True,
+                use_container_width=True,
+                disabled=["チェック項目", "スキルカテゴリ"],
+                column_config={"達成": st.column_config.CheckboxColumn("達成", width="small")},
+            )
+            answer = dict(zip(qids, edited["達成"].astype(bool).tolist()))
+        else:
+            answer = {}
+            for qid, label_text, default_value in zip(qids, labels, defaults):
+                # キーにシート名を含める（別シートの同じ NO と状態を共有しない）
+                answer[qid] = st.checkbox(label_text, key=f"{check_sheet}:{qid}", value=default_value)
 
         if st.button("保存"):
-            save_user_sheet_answers(st.session_state.user_id, check_sheet, answer)
-            st.success("FireStoreに保存しました。")
+            try:
+                saved = save_user_sheet_answers(st.session_state.user_id, check_sheet, answer)
+            except UnknownCatalogVersion as e:
+                # 読めない回答を上書きして消さないよう、保存しない
+                st.error(f"保存済みの回答のチェックシート（Ver{e}）が見つからないため保存できません。管理者に連絡してください。")
+            else:
+                if saved:
+                    st.success("FireStoreに保存しました。")
+                else:
+                    st.info("変更はありません。")
 
     # --- 分析モード ---
     elif st.session_state.mode == "analyze":
-        # 以下の分析コードは従来の get_user_answers 関数をそのまま利用可能
         st.header("📈 全体スキル達成度")
 
         skillevel_select = st.selectbox(
@@ -211,94 +228,41 @@ if st.session_state.get("logged_in", False):
             index=3
         )
 
-        # --- 全体達成度グラフ ---
-        def draw_donut_chart(user_id, skillevel_select):
-            achieved_count = 0
-            total_count = 0
-            remaining_required = {"★":0, "★★":0, "★★★":0}
-
-            for sheet in sheets:
-                df_sheet = sheet_data_cache[sheet].copy()
-                if skillevel_select != "ALL":
-                    df_sheet = df_sheet[df_sheet["スキルレベル"] == skillevel_select]
-
-                if df_sheet.empty:
-                    continue
-
-                filtered_ids = df_sheet["NO"].tolist()
-                result = get_user_answers(user_id, sheet, filtered_ids)
-                df_sheet["achieved"] = df_sheet["NO"].map(result)
+        # --- 達成度の集計（全シート・全レベルを1回で計算し、各グラフ・表で共有） ---
+        user_answers = {sheet: get_user_sheet_answers_cached(st.session_state.user_id, sheet) for sheet in sheets}
+        with metrics.span("scoring.evaluate"):
+            achievement = evaluate(catalog, user_answers)
 
-                achieved_count += df_sheet["achieved"].sum()
-                total_count += len(df_sheet)
-
-                for level in ["★","★★","★★★"]:
-                    remaining_required[level] += df_sheet[(df_sheet["スキルレベル"]==level) & 
-                                                          (~df_sheet["achieved"]) & 
-                                                          (df_sheet["必須"])].shape[0]
+        # --- 全体達成度グラフ ---
+        @metrics.timed("chart.donut")
+        def draw_donut_chart(achievement, skillevel_select):
+            achieved_count, total_count, _, _ = achievement.counts(level=skillevel_select)
 
             if total_count == 0:
                 st.info("表示できるデータがありません。")
                 return
 
-            values = [achieved_count, total_count - achieved_count]
-            fig, ax = plt.subplots()
-            ax.pie(values, startangle=90, counterclock=False,
-                   colors=["#99CCFF", "#D7D7D7"], wedgeprops=dict(width=0.35))
-            ax.axis("equal")
-            progress = (achieved_count / total_count) * 100
-            ax.text(0, 0, f"進捗度\n{progress:.0f}%", ha="center", va="center", fontsize=16, fontweight="bold", color="black")
             st.markdown(f"###### スキル達成度（{skillevel_select}）")
-            st.pyplot(fig)
-
-            if skillevel_select == "ALL":
-                total_remaining = sum(remaining_required.values())
-                st.markdown(f"**未達成の必須項目数**:**{total_remaining}** 件")
-            else:
-                st.markdown(f"**未達成の必須項目数**:**{remaining_required[skillevel_select]}** 件")
-
-        def draw_radar_chart_by_level(user_id, skillevel_select):
-            radar_scores = {}
-            for sheet in sheets:
-                df_sheet = sheet_data_cache[sheet].copy()
-                if skillevel_select != "ALL":
-                    df_sheet = df_sheet[df_sheet["スキルレベル"] == skillevel_select]
-
-                filtered_ids = df_sheet["NO"].tolist()
-                if not filtered_ids:
-                    radar_scores[sheet] = 0
-                    continue
+            st.image(donut_chart_image(achieved_count, total_count, "進捗度"), use_container_width=True)
 
-                result = get_user_answers(user_id, sheet, filtered_ids)
-                df_sheet["achieved"] = df_sheet["NO"].map(result)
+            st.markdown(f"**未達成の必須項目数**:**{achievement.remaining_required(skillevel_select)}** 件")
 
-                achieved_count = df_sheet["achieved"].sum()
-                total_count = len(df_sheet)
-                rate = (achieved_count / total_count) * 100 if total_count > 0 else 0
-                radar_scores[sheet] = rate
+        @metrics.timed("chart.radar_by_level")
+        def draw_radar_chart_by_level(achievement, skillevel_select):
+            radar_scores = {sheet: achievement.rate(sheet, skillevel_select) for sheet in sheets}
 
             if not radar_scores:
                 st.info("レーダーチャートを表示できるデータがありません")
                 return
 
-            radar_df = pd.DataFrame({
-                "category": list(radar_scores.keys()),
-                "value": list(radar_scores.values())
-            })
-
-            fig = px.line_polar(radar_df, r="value", theta="category",
-                                line_close=True, markers=True, range_r=[0,100])
-            fig.update_traces(fill="toself")
-            fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,100])),
-                              showlegend=False,
-                              title=f"全体スキル達成度（{skillevel_select})")
-            st.plotly_chart(fig, use_container_width=True)
+            st.plotly_chart(radar_chart_spec(radar_scores, f"全体スキル達成度（{skillevel_select})"),
+                            use_container_width=True)
 
         col1, col2 = st.columns([4,6])
         with col1:
-            draw_donut_chart(st.session_state.user_id, skillevel_select)
+            draw_donut_chart(achievement, skillevel_select)
         with col2:
-            draw_radar_chart_by_level(st.session_state.user_id, skillevel_select)
+            draw_radar_chart_by_level(achievement, skillevel_select)
 
         explanation = ""
 
@@ -313,7 +277,8 @@ if st.session_state.get("logged_in", False):
         if explanation:
             st.markdown(f"**{explanation}**")
 
-        def draw_summary_table_all_levels(user_id):
+        @metrics.timed("table.summary_all_levels")
+        def draw_summary_table_all_levels(achievement):
             summary_data = {
                 "スキルレベル": [],
                 "達成/未達成": [],
@@ -325,43 +290,17 @@ if st.session_state.get("logged_in", False):
             total_max_score = 0
 
             for level in ["★","★★","★★★"]:
-                level_achieved = 0
-                level_total = 0
-                level_required_achieved = 0
-                level_required_total = 0
-
-                for sheet in sheets:
-                    df_sheet = load_data(sheet)
-                    df_sheet = df_sheet[df_sheet["スキルレベル"] == level]
-
-                    if df_sheet.empty:
-                        continue
-
-                    filtered_ids = df_sheet["NO"].tolist()
-                    result = get_user_answers(user_id, sheet, filtered_ids)
-                    df_sheet["achieved"] = df_sheet["NO"].map(result)
-
-                    # 全項目
-                    level_total += len(df_sheet)
-                    level_achieved += df_sheet["achieved"].sum()
-
-                    # 必須項目
-                    req_df = df_sheet[df_sheet["必須"]]
-                    level_required_total += len(req_df)
-                    level_required_achieved += req_df["achieved"].sum()
-
                 # スコア計算（必須は+1点ボーナス）
-                level_score = level_achieved + level_required_achieved
-                level_max_score = level_total + level_required_total
+                s = achievement.level_scores(level)
 
-                if level_total > 0:
+                if s["total"] > 0:
                     summary_data["スキルレベル"].append(level)
-                    summary_data["達成/未達成"].append(f"{level_achieved} / {level_total}")
-                    summary_data["必須(達成/未達成)"].append(f"{level_required_achieved} / {level_required_total}")
-                    summary_data["点数"].append(f"{level_score} / {level_max_score}")
+                    summary_data["達成/未達成"].append(f"{s['achieved']} / {s['total']}")
+                    summary_data["必須(達成/未達成)"].append(f"{s['required_achieved']} / {s['required_total']}")
+                    summary_data["点数"].append(f"{s['score']} / {s['max_score']}")
 
-                    total_score += level_score
-                    total_max_score += level_max_score
+                    total_score += s["score"]
+                    total_max_score += s["max_score"]
 
             # --- 表にして表示 ---
             if summary_data["スキルレベル"]:
@@ -375,7 +314,33 @@ if st.session_state.get("logged_in", False):
                 st.info("表示できるデータがありません。")
 
 
-        draw_summary_table_all_levels(st.session_state.user_id) # 👈 追加
+        draw_summary_table_all_levels(achievement) # 👈 追加
+
+        # --- 次に学ぶおすすめ項目（次の認定レベルに近づく順） ---
+        st.markdown("---")
+        st.header("🎯 次に学ぶおすすめ項目")
+
+        @metrics.timed("recommend.panel")
+        def draw_recommendations(user_id, user_answers):
+            # 組織の行列は待たずに手元のものを使う（構築はバックグラウンド。まだなければ次の表示で出す）
+            org_matrix = latest_org_matrix(db, catalog_version)
+            if org_matrix is None:
+                st.info("おすすめを準備しています。しばらくしてから再度表示してください。")
+                return
+            rec = recommend(get_peer_index(org_matrix), user_answers, user_id)
+            if rec.level is None:
+                st.success("すべてのスキルレベルの認定基準を満たしています。")
+                return
+            st.markdown(f"**{rec.level}** の認定まで あと **{rec.remaining}** 件"
+                        f"（うち必須 **{rec.remaining_required}** 件）")
+            if rec.items.empty:
+                st.info("おすすめできる項目がありません。")
+                return
+            st.dataframe(rec.items, hide_index=True, use_container_width=True)
+            if rec.peer_count:
+                st.caption(f"同僚の達成率: 回答が近く、{rec.level} で先を行く {rec.peer_count} 人のうち達成している割合")
+
+        draw_recommendations(st.session_state.user_id, user_answers)
 
         # --- スキルカテゴリ別分析 ---
         st.markdown("---")
@@ -383,71 +348,61 @@ if st.session_state.get("logged_in", False):
         selected_sheet = st.selectbox("スキルカテゴリを選択してください", sheets)
         level_select = st.selectbox("スキルレベルを選択してください", ["★","★★","★★★","ALL"])
 
-        def load_filtered_sheet(user_id, sheet, level_select):
-            df_sheet = sheet_data_cache[sheet].copy()
-            if level_select != "ALL":
-                df_sheet = df_sheet[df_sheet["スキルレベル"] == level_select]
-            if df_sheet.empty:
-                return pd.DataFrame()
-            filtered_ids = df_sheet["NO"].tolist()
-            result = get_user_answers(user_id, sheet, filtered_ids)
-            df_sheet["achieved"] = df_sheet["NO"].map(result)
-            return df_sheet
-
-        def skill_pie_chart(df_sheet, sheet, level_select):
-            if df_sheet.empty:
+        @metrics.timed("chart.sheet_donut")
+        def skill_pie_chart(achievement, sheet, level_select):
+            achieved_count, total_count, _, _ = achievement.counts(sheet, level_select)
+            if total_count == 0:
                 st.info("対象データがありません")
                 return
-            achieved_count = df_sheet["achieved"].sum()
-            unachieved_count = (~df_sheet["achieved"]).sum()
-            values = [achieved_count, unachieved_count]
-            fig, ax = plt.subplots()
-            ax.pie(values, startangle=90, counterclock=False,
-                   colors=["#99CCFF", "#D7D7D7"], wedgeprops=dict(width=0.35))
-            ax.axis("equal")
-            total_count = df_sheet.shape[0]
-            progress = (achieved_count / total_count) * 100 if total_count > 0 else 0
-            ax.text(0, 0, f"達成度\n{progress:.0f}%", ha="center", va="center", fontsize=16, fontweight="bold", color="black")
             st.markdown(f"###### {sheet} - {level_select} 達成度チェック分析")
-            st.pyplot(fig)
+            st.image(donut_chart_image(achieved_count, total_count, "達成度"), use_container_width=True)
 
-        def skill_radar_chart(df_sheet, sheet, level_select):
-            if df_sheet.empty:
+        @metrics.timed("chart.sheet_radar")
+        def skill_radar_chart(achievement, sheet, level_select):
+            category_rates = achievement.category_rates(sheet, level_select)
+            if not category_rates:
                 st.info("対象データがありません")
                 return
-            category_rates = {}
-            for cat, group in df_sheet.groupby("スキルカテゴリ"):
-                total = len(group)
-                achieved = group["achieved"].sum()
-                category_rates[cat] = (achieved / total) * 100 if total > 0 else 0
-            radar_df = pd.DataFrame({"category": list(category_rates.keys()), "value": list(category_rates.values())})
-            fig = px.line_polar(radar_df, r="value", theta="category", line_close=True, markers=True, range_r=[0,100])
-            fig.update_traces(fill="toself")
-            fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,100])),
-                              showlegend=False,
-                              title=f"{sheet} - {level_select} スキルカテゴリ達成率（レーダーチャート）")
-            st.plotly_chart(fig, use_container_width=True)
-
-        def draw_summary_table(df_sheet, sheet, level_select):
-            if df_sheet.empty:
+            st.plotly_chart(radar_chart_spec(category_rates, f"{sheet} - {level_select} スキルカテゴリ達成率（レーダーチャート）"),
+                            use_container_width=True)
+
+        @metrics.timed("table.sheet_summary")
+        def draw_summary_table(achievement, sheet, level_select):
+            category_counts = achievement.sheets[sheet].category_counts(level_select)
+            if not category_counts:
                 st.info("対象データがありません")
                 return
-            achieved_count = df_sheet[df_sheet["achieved"]==True]["スキルカテゴリ"].value_counts()
-            total_count = df_sheet["スキルカテゴリ"].value_counts()
-            summary_df = pd.DataFrame({"達成件数": achieved_count, "合計件数": total_count}).fillna(0).astype(int)
+            summary_df = pd.DataFrame(
+                {"達成件数": [a for _, a, _ in category_counts], "合計件数": [t for _, _, t in category_counts]},
+                index=pd.Index([cat for cat, _, _ in category_counts], name="スキルカテゴリ"),
+            )
             summary_df["達成/合計"] = summary_df["達成件数"].astype(str) + "/" + summary_df["合計件数"].astype(str)
             st.markdown(f"##### {sheet} - {level_select} 達成状況")
             st.dataframe(summary_df[["達成/合計"]])
 
         # --- 実行 ---
-        df_sheet = load_filtered_sheet(st.session_state.user_id, selected_sheet, level_select)
         col1, col2 = st.columns([4, 6])
         with col1:
-            skill_pie_chart(df_sheet, selected_sheet, level_select)
+            skill_pie_chart(achievement, selected_sheet, level_select)
         with col2:
-            skill_radar_chart(df_sheet, selected_sheet, level_select)
+            skill_radar_chart(achievement, selected_sheet, level_select)
         st.markdown("---")
-        draw_summary_table(df_sheet, selected_sheet, level_select)
+        draw_summary_table(achievement, selected_sheet, level_select)
+
+        # --- 達成度の推移（保存時に更新される日次ロールアップを読むだけ） ---
+        st.markdown("---")
+        st.header("📅 達成度の推移")
+        trend_level = st.selectbox("スキルレベルを選択してください", ["★","★★","★★★","ALL"], index=3, key="trend_level")
+
+        @metrics.timed("chart.trend")
+        def draw_trend_chart(user_id, level):
+            trend = trend_frame(fetch_rollups(db, user_id), level, sheets)
+            if trend.empty:
+                st.info("保存の記録がまだありません。")
+                return
+            st.line_chart(trend, y_label="達成率(%)")
+
+        draw_trend_chart(st.session_state.user_id, trend_level)
 
         st.markdown("---")
         st.markdown("""
@@ -456,3 +411,45 @@ if st.session_state.get("logged_in", False):
         st.markdown("""
          © IPA — 本アプリはIPAの公開資料をもとに作成したものであり、非営利・教育目的での利用のみを目的としています。
 """)
+
+    # --- 組織分析モード ---
+    elif st.session_state.mode == "org":
+        st.header("🏢 組織スキル分析")
+
+        # 全ユーザーの回答行列（プロセス内で保持し、保存のたびに差分更新）
+        with metrics.span("org.matrix"):
+            org_matrix = get_org_matrix(db, catalog_version)
+        department = st.selectbox("部署を選択してください", ["全体"] + org_matrix.department_names())
+        org_level = st.selectbox("スキルレベルを選択してください", ["★","★★","★★★","ALL"], index=3, key="org_level")
+        with metrics.span("org.stats"):
+            cohort = org_matrix.stats(None if department == "全体" else department)
+
+        if cohort.user_count == 0:
+            st.info("表示できるデータがありません。")
+        else:
+            st.markdown(f"**対象人数**: **{cohort.user_count}** 人")
+
+            # --- レベル別の認定基準を満たす人数 ---
+            tier_labels = {
+                "★": "Assistant Data Scientist (★70％以上 + ★必須すべて)",
+                "★★": "Associate Data Scientist (★★60％以上 + ★★必須すべて)",
+                "★★★": "Full Data Scientist (★★★50％以上 + ★★★必須すべて)",
+            }
+            tier_cols = st.columns(3)
+            for col, (level, count) in zip(tier_cols, cohort.tier_counts().items()):
+                col.metric(tier_labels[level], f"{count} 人", f"{count / cohort.user_count * 100:.0f}%", delta_color="off")
+
+            col1, col2 = st.columns([5, 5])
+            with col1:
+                st.markdown(f"##### 達成率の分布（{org_level}）")
+                st.bar_chart(cohort.progress_histogram(org_level))
+            with col2:
+                st.markdown(f"##### 達成率の低いスキルカテゴリ（{org_level}）")
+                st.dataframe(cohort.category_rates(org_level).head(10), use_container_width=True)
+
+            st.markdown("---")
+            org_sheet = st.selectbox("シートを選択してください", sheets, key="org_sheet")
+            st.markdown(f"##### {org_sheet} - {org_level} 項目別達成率")
+            st.dataframe(cohort.item_rates(org_sheet, org_level), use_container_width=True)
+
+metrics.end_rerun(mode=st.session_state.get("mode"))
@@ -0,0 +1,538 @@
+"""永続化バックエンド（users / sessions / skill_answers と回答履歴の読み書き）。
+
+storage.py のキャッシュ・差分保存・セッション管理はこのインターフェースだけを使う。
+FirestoreBackend は既存の Firestore 構成、SQLiteBackend は1台で完結する構成
+（オンプレ・開発・ベンチマーク用）。回答ドキュメントはどちらも dict
+{"user_id", "sheet", "bits", "catalog_version", "updated_at"} でやり取りする
+（bits はカタログ順のパック済みビット列。旧形式のドキュメントは bits の代わりに answers マップを持つ）。
+
+Firestore の履歴の読み込みは複合インデックスを使う。firestore.indexes.json を
+`firebase deploy --only firestore:indexes` で登録しておくこと。
+"""
+import contextlib
+import json
+import queue
+import sqlite3
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+import metrics
+
+ANSWERS_COLLECTION = "skill_answers"
+SESSIONS_COLLECTION = "sessions"
+USERS_COLLECTION = "users"
+HISTORY_COLLECTION = "skill_history"
+ROLLUPS_COLLECTION = "skill_rollups"
+
+FIRESTORE_BATCH_LIMIT = 500
+PAGE_SIZE = 500
+
+
+def answers_doc_id(user_id, sheet) -> str:
+    return f"{user_id}_{sheet}"
+
+
+class StorageBackend(ABC):
+    """バックエンドのインターフェース。回答ドキュメントのキーは (user_id, sheet)。
+
+    pop_legacy_session 以外はすべて実装すること（足りないバックエンドは生成時に TypeError になる）。
+    """
+
+    # --- users ---
+    @abstractmethod
+    def get_user(self, user_id):
+        # ユーザードキュメント（password を含む）。なければ None
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_user(self, user_id, data, merge=True):
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_users(self, page_size=PAGE_SIZE, fields=None):
+        # (user_id, dict) をページ単位で流す
+        raise NotImplementedError
+
+    # --- sessions ---
+    @abstractmethod
+    def get_session(self, key):
+        # {"user_id", "created_at"}。なければ None
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_session(self, key, data):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_session(self, key):
+        raise NotImplementedError
+
+    def pop_legacy_session(self, token):
+        # 旧形式のセッションを取り出して削除する（旧形式を持たないバックエンドは None）
+        return None
+
+    @abstractmethod
+    def delete_sessions_before(self, cutoff) -> int:
+        raise NotImplementedError
+
+    # --- skill_answers ---
+    @abstractmethod
+    def get_answers(self, keys) -> dict:
+        # { (user_id, sheet): ドキュメント }（存在するものだけ）
+        raise NotImplementedError
+
+    @abstractmethod
+    def write_answers(self, writes):
+        # writes: [(user_id, sheet, data, merge)]。merge=True なら answers は項目単位で上書きし、
+        # data にないフィールドは保持する。merge=False ならドキュメント全体を置き換える
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_answers(self, keys, update):
+        # keys（FIRESTORE_BATCH_LIMIT 件まで）を1トランザクションで読み直して書き換える。
+        # update(user_id, sheet, 現在のドキュメントまたは None) -> (data, merge)。
+        # 競合した場合は読み直して update から再実行する（update は副作用を持たせないこと）
+        raise NotImplementedError
+
+    @abstractmethod
+    def iter_answers(self, page_size=PAGE_SIZE):
+        raise NotImplementedError
+
+    # --- 履歴・日次ロールアップ ---
+    @abstractmethod
+    def append_history(self, entries, rollups):
+        # entries: [{"user_id", "sheet", "at", "catalog_version", "checkpoint", "flipped", "achieved"(チェックポイントのみ)}]
+        # rollups: [{"user_id", "sheet", "day", "levels"}]（同じ日の行は上書き）。まとめて1回で書き込む
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_history(self, user_id, sheet, until=None) -> list:
+        # until 以前の直近のチェックポイントから until までの履歴（時刻順）
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_rollups(self, user_id) -> list:
+        raise NotImplementedError
+
+
+# ---- Firestore ----
+class FirestoreBackend(StorageBackend):
+
+    def __init__(self, client):
+        self.client = client
+
+    def _document(self, collection, doc_id):
+        return self.client.collection(collection).document(doc_id)
+
+    def _iter_collection(self, collection, page_size, fields=None):
+        # ドキュメントID順にページングして全件を流す（一度に全件をメモリに載せない）
+        query = self.client.collection(collection)
+        if fields is not None:
+            query = query.select(fields)
+        query = query.order_by("__name__").limit(page_size)
+        last = None
+        while True:
+            page = list((query.start_after(last) if last is not None else query).stream())
+            yield from page
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    def get_user(self, user_id):
+        doc = self._document(USERS_COLLECTION, user_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_user(self, user_id, data, merge=True):
+        self._document(USERS_COLLECTION, user_id).set(data, merge=merge)
+
+    def iter_users(self, page_size=PAGE_SIZE, fields=None):
+        for doc in self._iter_collection(USERS_COLLECTION, page_size, fields):
+            yield doc.id, doc.to_dict() or {}
+
+    def get_session(self, key):
+        doc = self._document(SESSIONS_COLLECTION, key).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set_session(self, key, data):
+        self._document(SESSIONS_COLLECTION, key).set(data)
+
+    def delete_session(self, key):
+        self._document(SESSIONS_COLLECTION, key).delete()
+
+    def pop_legacy_session(self, token):
+        # 旧形式（ドキュメントID = user_id, token フィールド）
+        legacy = self.client.collection(SESSIONS_COLLECTION).where("token", "==", token).limit(1).get()
+        if not legacy:
+            return None
+        legacy[0].reference.delete()
+        return legacy[0].to_dict()
+
+    def delete_sessions_before(self, cutoff) -> int:
+        query = self.client.collection(SESSIONS_COLLECTION).where("created_at", "<", cutoff)
+        deleted = 0
+        batch = self.client.batch()
+        for doc in query.stream():
+            batch.delete(doc.reference)
+            deleted += 1
+            if deleted % FIRESTORE_BATCH_LIMIT == 0:
+                batch.commit()
+                batch = self.client.batch()
+        if deleted % FIRESTORE_BATCH_LIMIT:
+            batch.commit()
+        return deleted
+
+    def get_answers(self, keys) -> dict:
+        # 1回の get_all でまとめて取得する
+        collection = self.client.collection(ANSWERS_COLLECTION)
+        refs = {answers_doc_id(user_id, sheet): (user_id, sheet) for user_id, sheet in keys}
+        return {refs[doc.id]: doc.to_dict()
+                for doc in self.client.get_all([collection.document(doc_id) for doc_id in refs])
+                if doc.exists}
+
+    def write_answers(self, writes):
+        collection = self.client.collection(ANSWERS_COLLECTION)
+        if len(writes) == 1:
+            user_id, sheet, data, merge = writes[0]
+            collection.document(answers_doc_id(user_id, sheet)).set(data, merge=merge)
+            return
+        # バッチ上限（500件）ごとにコミットする
+        for start in range(0, len(writes), FIRESTORE_BATCH_LIMIT):
+            batch = self.client.batch()
+            for user_id, sheet, data, merge in writes[start:start + FIRESTORE_BATCH_LIMIT]:
+                batch.set(collection.document(answers_doc_id(user_id, sheet)), data, merge=merge)
+            batch.commit()
+
+    def update_answers(self, keys, update):
+        from google.cloud import firestore
+
+        collection = self.client.collection(ANSWERS_COLLECTION)
+        refs = {answers_doc_id(user_id, sheet): (user_id, sheet) for user_id, sheet in keys}
+
+        @firestore.transactional
+        def run(transaction):
+            # 読んだドキュメントがコミットまでに書き換えられていたら Aborted になり、ここから再実行される
+            current = {refs[doc.id]: doc.to_dict()
+                       for doc in transaction.get_all([collection.document(doc_id) for doc_id in refs])
+                       if doc.exists}
+            for doc_id, (user_id, sheet) in refs.items():
+                data, merge = update(user_id, sheet, current.get((user_id, sheet)))
+                transaction.set(collection.document(doc_id), data, merge=merge)
+
+        run(self.client.transaction())
+
+    def iter_answers(self, page_size=PAGE_SIZE):
+        for doc in self._iter_collection(ANSWERS_COLLECTION, page_size):
+            yield doc.to_dict()
+
+    def append_history(self, entries, rollups):
+        batch = self.client.batch()
+        for e in entries:
+            doc_id = f"{answers_doc_id(e['user_id'], e['sheet'])}_{e['at']:%Y%m%dT%H%M%S%f}"
+            batch.set(self._document(HISTORY_COLLECTION, doc_id), e)
+        for r in rollups:
+            batch.set(self._document(ROLLUPS_COLLECTION, f"{answers_doc_id(r['user_id'], r['sheet'])}_{r['day']}"), r)
+        batch.commit()
+
+    def get_history(self, user_id, sheet, until=None) -> list:
+        # until 以前の直近のチェックポイントを1件だけ引き、そこから until までを時刻順に読む
+        # （どちらのクエリも firestore.indexes.json の複合インデックスを使う）
+        query = self.client.collection(HISTORY_COLLECTION).where("user_id", "==", user_id).where("sheet", "==", sheet)
+        if until is not None:
+            query = query.where("at", "<=", until)
+        latest = query.where("checkpoint", "==", True).order_by("at", direction="DESCENDING").limit(1).get()
+        if not latest:
+            return []
+        return [doc.to_dict() for doc in query.where("at", ">=", latest[0].get("at")).order_by("at").stream()]
+
+    def get_rollups(self, user_id) -> list:
+        return [doc.to_dict() for doc in
+                self.client.collection(ROLLUPS_COLLECTION).where("user_id", "==", user_id).stream()]
+
+
+# ---- SQLite ----
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    department TEXT NOT NULL DEFAULT '',
+    data TEXT NOT NULL                  -- ユーザードキュメント全体（JSON）
+);
+CREATE INDEX IF NOT EXISTS users_department ON users (department);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    key TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL            -- UNIX 時刻
+);
+CREATE INDEX IF NOT EXISTS sessions_created_at ON sessions (created_at);
+
+CREATE TABLE IF NOT EXISTS skill_answers (
+    user_id TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    answers TEXT NOT NULL,              -- 旧形式の { str(NO): bool }（JSON。bits で保存した行は {}）
+    catalog_version TEXT,
+    bits BLOB,                          -- catalog_version の版のカタログ順のパック済みビット列
+    updated_at REAL,
+    PRIMARY KEY (user_id, sheet)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS skill_history (
+    user_id TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    at REAL NOT NULL,
+    catalog_version TEXT,
+    flipped TEXT NOT NULL,              -- 値が変わった NO（JSON 配列）
+    achieved TEXT                       -- チェックポイントのみ: 達成済みの NO（JSON 配列）
+);
+CREATE INDEX IF NOT EXISTS skill_history_user_sheet_at ON skill_history (user_id, sheet, at);
+CREATE INDEX IF NOT EXISTS skill_history_checkpoints ON skill_history (user_id, sheet, at)
+    WHERE achieved IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS skill_rollups (
+    user_id TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    day TEXT NOT NULL,                  -- YYYY-MM-DD
+    levels TEXT NOT NULL,               -- { レベル: [達成件数, 合計件数] }（JSON）
+    PRIMARY KEY (user_id, sheet, day)
+) WITHOUT ROWID;
+"""
+
+# merge はフィールド単位の上書き（answers は json_patch で項目単位）
+_MERGE_ANSWERS = """
+INSERT INTO skill_answers (user_id, sheet, answers, bits, catalog_version, updated_at) VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (user_id, sheet) DO UPDATE SET
+    answers = json_patch(answers, excluded.answers),
+    bits = coalesce(excluded.bits, bits),
+    catalog_version = coalesce(excluded.catalog_version, catalog_version),
+    updated_at = coalesce(excluded.updated_at, updated_at)
+"""
+_REPLACE_ANSWERS = """
+INSERT OR REPLACE INTO skill_answers (user_id, sheet, answers, bits, catalog_version, updated_at)
+VALUES (?, ?, ?, ?, ?, ?)
+"""
+_SELECT_ANSWERS = "SELECT user_id, sheet, answers, bits, catalog_version, updated_at FROM skill_answers"
+# 1文あたりのキー数（SQLite のパラメータ数上限に収める）
+_KEYS_PER_QUERY = 400
+
+
+def _timestamp(value):
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def _datetime(value):
+    return None if value is None else datetime.fromtimestamp(value, timezone.utc)
+
+
+def _answers_row(row) -> dict:
+    user_id, sheet, answers, bits, catalog_version, updated_at = row
+    data = {"user_id": user_id, "sheet": sheet, "updated_at": _datetime(updated_at)}
+    if bits is not None:
+        data["bits"] = bytes(bits)
+    else:
+        data["answers"] = json.loads(answers)
+    if catalog_version is not None:
+        data["catalog_version"] = catalog_version
+    return data
+
+
+class SQLiteBackend(StorageBackend):
+    """1ファイルの SQLite（WAL）。接続はスレッド間で使い回すプールから取り出す。"""
+
+    def __init__(self, path, pool_size=8, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+        with self._connection() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")  # 読み込みは書き込み中もブロックされない
+            with conn:
+                conn.executescript(SQLITE_SCHEMA)
+                # bits 列を追加する前に作ったファイル
+                if "bits" not in {row[1] for row in conn.execute("PRAGMA table_info(skill_answers)")}:
+                    conn.execute("ALTER TABLE skill_answers ADD COLUMN bits BLOB")
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL ではコミットごとの fsync を省いても壊れない
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute("PRAGMA cache_size=-16000")
+        return conn
+
+    @contextlib.contextmanager
+    def _connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        try:
+            yield conn
+        finally:
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+    # --- users ---
+    @metrics.timed("sqlite.get_user")
+    def get_user(self, user_id):
+        with self._connection() as conn:
+            row = conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_user(self, user_id, data, merge=True):
+        self.set_users([(user_id, data)], merge=merge)
+
+    @metrics.timed("sqlite.set_users")
+    def set_users(self, items, merge=True):
+        # items: [(user_id, data)]（1トランザクションでまとめて書き込む）
+        sql = """
+            INSERT INTO users (user_id, department, data) VALUES (?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                data = json_patch(data, excluded.data),
+                department = coalesce(json_extract(json_patch(data, excluded.data), '$.department'), '')
+        """ if merge else "INSERT OR REPLACE INTO users (user_id, department, data) VALUES (?, ?, ?)"
+        with self._connection() as conn, conn:
+            conn.executemany(sql, [(user_id, str(data.get("department") or ""), json.dumps(data, ensure_ascii=False))
+                                   for user_id, data in items])
+
+    def iter_users(self, page_size=PAGE_SIZE, fields=None):
+        last = ""
+        while True:
+            with self._connection() as conn:
+                page = conn.execute("SELECT user_id, data FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                                    (last, page_size)).fetchall()
+            for user_id, data in page:
+                data = json.loads(data)
+                if fields is not None:
+                    data = {k: v for k, v in data.items() if k in fields}
+                yield user_id, data
+            if len(page) < page_size:
+                return
+            last = page[-1][0]
+
+    # --- sessions ---
+    @metrics.timed("sqlite.get_session")
+    def get_session(self, key):
+        with self._connection() as conn:
+            row = conn.execute("SELECT user_id, created_at FROM sessions WHERE key = ?", (key,)).fetchone()
+        return None if row is None else {"user_id": row[0], "created_at": _datetime(row[1])}
+
+    @metrics.timed("sqlite.set_session")
+    def set_session(self, key, data):
+        with self._connection() as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (key, user_id, created_at) VALUES (?, ?, ?)",
+                         (key, data["user_id"], _timestamp(data["created_at"])))
+
+    def delete_session(self, key):
+        with self._connection() as conn, conn:
+            conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+
+    def delete_sessions_before(self, cutoff) -> int:
+        with self._connection() as conn, conn:
+            return conn.execute("DELETE FROM sessions WHERE created_at < ?", (_timestamp(cutoff),)).rowcount
+
+    # --- skill_answers ---
+    @staticmethod
+    def _select_answers(conn, keys) -> dict:
+        keys = list(keys)
+        result = {}
+        for start in range(0, len(keys), _KEYS_PER_QUERY):
+            chunk = keys[start:start + _KEYS_PER_QUERY]
+            values = ", ".join(["(?, ?)"] * len(chunk))
+            rows = conn.execute(f"{_SELECT_ANSWERS} WHERE (user_id, sheet) IN (VALUES {values})",
+                                [v for key in chunk for v in key]).fetchall()
+            for row in rows:
+                result[(row[0], row[1])] = _answers_row(row)
+        return result
+
+    @staticmethod
+    def _write_answers(conn, writes):
+        merges, replaces = [], []
+        for user_id, sheet, data, merge in writes:
+            bits = data.get("bits")
+            (merges if merge else replaces).append((
+                user_id, sheet, json.dumps(data.get("answers", {}), ensure_ascii=False),
+                None if bits is None else bytes(bits),
+                data.get("catalog_version"), _timestamp(data.get("updated_at")),
+            ))
+        if replaces:
+            conn.executemany(_REPLACE_ANSWERS, replaces)
+        if merges:
+            conn.executemany(_MERGE_ANSWERS, merges)
+
+    @metrics.timed("sqlite.get_answers")
+    def get_answers(self, keys) -> dict:
+        with self._connection() as conn:
+            return self._select_answers(conn, keys)
+
+    @metrics.timed("sqlite.write_answers")
+    def write_answers(self, writes):
+        with self._connection() as conn, conn:
+            self._write_answers(conn, writes)
+
+    @metrics.timed("sqlite.update_answers")
+    def update_answers(self, keys, update):
+        # BEGIN IMMEDIATE で書き込みロックを先に取るので、読んでから書くまでに他の書き込みは入らない
+        with self._connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                current = self._select_answers(conn, keys)
+                self._write_answers(conn, [(user_id, sheet, *update(user_id, sheet, current.get((user_id, sheet))))
+                                           for user_id, sheet in keys])
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+
+    @metrics.timed("sqlite.append_history")
+    def append_history(self, entries, rollups):
+        with self._connection() as conn, conn:
+            conn.executemany(
+                "INSERT INTO skill_history (user_id, sheet, at, catalog_version, flipped, achieved) VALUES (?, ?, ?, ?, ?, ?)",
+                [(e["user_id"], e["sheet"], _timestamp(e["at"]), e.get("catalog_version"), json.dumps(e["flipped"]),
+                  None if e.get("achieved") is None else json.dumps(e["achieved"])) for e in entries])
+            conn.executemany(
+                "INSERT OR REPLACE INTO skill_rollups (user_id, sheet, day, levels) VALUES (?, ?, ?, ?)",
+                [(r["user_id"], r["sheet"], r["day"], json.dumps(r["levels"], ensure_ascii=False)) for r in rollups])
+
+    def get_history(self, user_id, sheet, until=None) -> list:
+        until = float("inf") if until is None else _timestamp(until)
+        with self._connection() as conn:
+            start = conn.execute("SELECT max(at) FROM skill_history WHERE user_id = ? AND sheet = ? "
+                                 "AND achieved IS NOT NULL AND at <= ?", (user_id, sheet, until)).fetchone()[0]
+            if start is None:
+                return []
+            rows = conn.execute("SELECT at, catalog_version, flipped, achieved FROM skill_history "
+                                "WHERE user_id = ? AND sheet = ? AND at >= ? AND at <= ? ORDER BY at",
+                                (user_id, sheet, start, until)).fetchall()
+        return [{"user_id": user_id, "sheet": sheet, "at": _datetime(at), "catalog_version": version,
+                 "flipped": json.loads(flipped), "achieved": None if achieved is None else json.loads(achieved)}
+                for at, version, flipped, achieved in rows]
+
+    @metrics.timed("sqlite.get_rollups")
+    def get_rollups(self, user_id) -> list:
+        with self._connection() as conn:
+            rows = conn.execute("SELECT sheet, day, levels FROM skill_rollups WHERE user_id = ?", (user_id,)).fetchall()
+        return [{"user_id": user_id, "sheet": sheet, "day": day, "levels": json.loads(levels)}
+                for sheet, day, levels in rows]
+
+    def iter_answers(self, page_size=PAGE_SIZE):
+        last = ("", "")
+        while True:
+            with self._connection() as conn:
+                page = conn.execute(f"{_SELECT_ANSWERS} WHERE (user_id, sheet) > (?, ?) "
+                                    "ORDER BY user_id, sheet LIMIT ?", (*last, page_size)).fetchall()
+            for row in page:
+                yield _answers_row(row)
+            if len(page) < page_size:
+                return
+            last = (page[-1][0], page[-1][1])
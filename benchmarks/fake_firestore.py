@@ -0,0 +1,236 @@
+"""ベンチマーク用のインメモリ Firestore。
+
+app.py / storage.py / analytics.py / bulk_tool.py が使う範囲の API だけを実装する。
+RPC 単位で呼び出し回数・読み書きドキュメント数を数え、latency 秒の遅延を注入できる。
+トランザクションは楽観的ロック（読んだドキュメントがコミットまでに書き換えられていたら Aborted）で、
+google.cloud.firestore.transactional からそのまま使える。
+"""
+import copy
+import operator
+import threading
+import time
+from collections import Counter
+
+from google.api_core.exceptions import Aborted
+
+_OPS = {"==": operator.eq, "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+def _deep_merge(target, data):
+    for key, value in data.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+        self.path = f"{collection}/{doc_id}"
+
+    def _snapshot(self):
+        return FakeSnapshot(self, copy.deepcopy(self._db.data.get(self._collection, {}).get(self.id)))
+
+    def get(self, *args, **kwargs):
+        self._db._rpc("get", reads=1)
+        return self._snapshot()
+
+    def _set(self, data, merge=False):
+        self._db.revisions[self.path] += 1
+        docs = self._db.data.setdefault(self._collection, {})
+        if merge and self.id in docs:
+            _deep_merge(docs[self.id], copy.deepcopy(data))
+        else:
+            docs[self.id] = copy.deepcopy(data)
+
+    def _delete(self):
+        self._db.revisions[self.path] += 1
+        self._db.data.get(self._collection, {}).pop(self.id, None)
+
+    def set(self, data, merge=False):
+        self._db._rpc("set", writes=1)
+        with self._db.lock:
+            self._set(data, merge)
+
+    def delete(self):
+        self._db._rpc("delete", writes=1)
+        with self._db.lock:
+            self._delete()
+
+
+class FakeQuery:
+    def __init__(self, db, collection, filters=(), limit=None, start_after=None, orders=()):
+        self._db = db
+        self._collection = collection
+        self._filters = filters
+        self._limit = limit
+        self._start_after = start_after
+        self._orders = orders
+
+    def _copy(self, **kwargs):
+        args = dict(filters=self._filters, limit=self._limit, start_after=self._start_after, orders=self._orders)
+        args.update(kwargs)
+        return FakeQuery(self._db, self._collection, **args)
+
+    def where(self, field, op, value):
+        return self._copy(filters=self._filters + ((field, _OPS[op], value),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, fields):
+        return self._copy()
+
+    def order_by(self, field, direction="ASCENDING"):
+        # フィールド順の並べ替えはページング（start_after）とは併用しない（start_after はドキュメントID順のみ）
+        if field == "__name__":
+            return self._copy()
+        return self._copy(orders=self._orders + ((field, direction == "DESCENDING"),))
+
+    def start_after(self, snapshot):
+        return self._copy(start_after=snapshot.id)
+
+    def stream(self):
+        with self._db.lock:
+            items = sorted(self._db.data.get(self._collection, {}).items())
+        for field, descending in reversed(self._orders):
+            items = [item for item in items if field in item[1]]
+            items.sort(key=lambda item: item[1][field], reverse=descending)
+        result = []
+        for doc_id, data in items:
+            if self._start_after is not None and doc_id <= self._start_after:
+                continue
+            if all(field in data and op(data[field], value) for field, op, value in self._filters):
+                result.append(FakeSnapshot(FakeDocument(self._db, self._collection, doc_id), copy.deepcopy(data)))
+                if self._limit is not None and len(result) >= self._limit:
+                    break
+        self._db._rpc("query", reads=max(1, len(result)))
+        return iter(result)
+
+    def get(self):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def document(self, doc_id):
+        return FakeDocument(self._db, self._collection, doc_id)
+
+
+class FakeBatch:
+    def __init__(self, db):
+        self._db = db
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(lambda: reference._set(data, merge))
+
+    def delete(self, reference):
+        self._ops.append(reference._delete)
+
+    def commit(self):
+        self._db._rpc("commit", writes=len(self._ops))
+        with self._db.lock:
+            for op in self._ops:
+                op()
+
+
+class FakeTransaction(FakeBatch):
+    # transactional が使う内部 API（_begin / _commit / _rollback など）も実装する
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db):
+        super().__init__(db)
+        self._id = None
+        self._read = {}  # { path: 読んだ時点のリビジョン }
+
+    def _clean_up(self):
+        self._ops = []
+        self._read = {}
+        self._id = None
+
+    def _begin(self, retry_id=None):
+        self._db._rpc("begin_transaction")
+        self._id = object()
+
+    def get_all(self, references):
+        references = list(references)
+        self._db._rpc("get_all", reads=len(references))
+        with self._db.lock:
+            for reference in references:
+                self._read[reference.path] = self._db.revisions[reference.path]
+            return [reference._snapshot() for reference in references]
+
+    def _commit(self):
+        self._db._rpc("commit", writes=len(self._ops))
+        with self._db.lock:
+            if any(self._db.revisions[path] != revision for path, revision in self._read.items()):
+                self._clean_up()
+                raise Aborted("transaction conflict")
+            for op in self._ops:
+                op()
+        self._clean_up()
+
+    def _rollback(self):
+        self._clean_up()
+
+
+class FakeFirestore:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.data = {}  # { collection: { doc_id: dict } }
+        self.lock = threading.RLock()
+        self.revisions = Counter()  # { ドキュメントのパス: 書き込み回数 }
+        self.calls = Counter()
+        self.reads = 0
+        self.writes = 0
+
+    def _rpc(self, kind, reads=0, writes=0):
+        with self.lock:
+            self.calls[kind] += 1
+            self.reads += reads
+            self.writes += writes
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None):
+        references = list(references)
+        self._rpc("get_all", reads=len(references))
+        return [reference._snapshot() for reference in references]
+
+    def counters(self):
+        with self.lock:
+            return {"rpcs": sum(self.calls.values()), "reads": self.reads, "writes": self.writes,
+                    "calls": dict(self.calls)}
+
+    def reset_counters(self):
+        with self.lock:
+            self.calls.clear()
+            self.reads = 0
+            self.writes = 0
@@ -0,0 +1,331 @@
+"""app.py の再実行コストを測るベンチマーク。
+
+firebase_admin を FakeFirestore に差し替え、Streamlit の AppTest で
+ログイン → 保存モード → 分析モード → 組織分析モードの操作を順に実行し、
+操作ごとの実行時間・Firestore の RPC / 読み書き件数、シナリオごとのピークメモリを測る
+（SQLite バックエンドのシナリオはフェイクを通らないので、RPC / 読み書き件数は出力しない）。
+あわせて主要な関数（カタログ読み込み、回答取得、集計、グラフ描画）を単体で計測する。
+
+    python benchmarks/run_benchmarks.py --scales 1,4 --users 10,1000 --output bench.json
+    python benchmarks/run_benchmarks.py --baseline bench.json   # 劣化があれば終了コード 1
+    python benchmarks/run_benchmarks.py --backends firestore,sqlite   # 同じデータを SQLite でも測る
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import pandas as pd  # noqa: E402
+
+import analytics  # noqa: E402
+import catalog  # noqa: E402
+import catalog_registry  # noqa: E402
+import charts  # noqa: E402
+import history  # noqa: E402
+import recommend  # noqa: E402
+import resources  # noqa: E402
+import scoring  # noqa: E402
+import storage  # noqa: E402
+from backends import FirestoreBackend, SQLiteBackend  # noqa: E402
+from benchmarks.fake_firestore import FakeFirestore  # noqa: E402
+
+APP_PATH = str(ROOT / "app.py")
+BENCH_USER = "bench_user"
+BENCH_PASSWORD = "bench-password"
+
+
+def install_fake(db):
+    # app.py の firebase_admin 初期化をフェイクに向ける
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    credentials.Certificate = lambda config: object()
+    firebase_admin.initialize_app = lambda *args, **kwargs: None
+    firebase_admin._apps = firebase_admin._apps or {"[DEFAULT]": object()}
+    firestore.client = lambda *args, **kwargs: db
+
+
+def reset_caches():
+    catalog._catalogs.clear()
+    catalog_registry._registries.clear()
+    scoring._indexes.clear()
+    storage.answers_cache.clear()
+    storage.session_cache.clear()
+    storage.profile_cache.clear()
+    charts.clear_cache()
+    if analytics._building is not None:  # 前のシナリオの行列の構築が終わるのを待つ
+        analytics._building[0].join()
+    analytics._matrix = None
+    recommend._peers = None
+    resources._backend = None
+    history.rollup_cache.clear()
+    history._checkpoints.clear()
+
+
+def make_workbook(scale, directory) -> str:
+    # 元のワークブックの行を scale 倍に複製した合成ワークブック（アプリはディレクトリ単位で読む）
+    if scale == 1:
+        return str(ROOT / catalog.WORKBOOK_PATH)
+    path = os.path.join(directory, f"x{scale}", os.path.basename(catalog.WORKBOOK_PATH))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with pd.ExcelWriter(path) as writer:
+        for sheet in catalog.SHEETS:
+            base = catalog.get_catalog(str(ROOT / catalog.WORKBOOK_PATH), catalog.SHEETS).frame(sheet)
+            df = pd.concat([base] * scale, ignore_index=True)
+            df["NO"] = range(1, len(df) + 1)
+            df["必須"] = df["必須"].map({True: 1, False: None})
+            df.to_excel(writer, sheet_name=sheet, startrow=2, index=False)
+    return path
+
+
+def seed(db, cat, users, version, fill=0.5, seed_value=0):
+    # 回答は保存時と同じ形式（version の版のビット列）で入れる
+    rng = random.Random(seed_value)
+    index = scoring.get_index(cat)
+    db.data = {"users": {}, "skill_answers": {}, "sessions": {}}
+    db.data["users"][BENCH_USER] = {
+        "password": hashlib.sha256(BENCH_PASSWORD.encode()).hexdigest(),
+        "role": "manager",
+        "department": "dept0",
+    }
+    for i in range(users):
+        user_id = f"user{i:05d}"
+        db.data["users"][user_id] = {"password": "", "department": f"dept{i % 5}"}
+        for sheet in cat.sheet_names:
+            si = index[sheet]
+            answers = {no: rng.random() < fill for no in si.keys}
+            db.data["skill_answers"][f"{user_id}_{sheet}"] = {
+                "user_id": user_id, "sheet": sheet, "catalog_version": version,
+                "bits": scoring.SheetAnswers.from_dict(si, answers).to_bytes(),
+            }
+
+
+def seed_sqlite(db, path):
+    # フェイクに入れたのと同じデータを SQLite に写す
+    if os.path.exists(path):
+        os.remove(path)
+    backend = SQLiteBackend(path)
+    backend.set_users(list(db.data["users"].items()), merge=False)
+    backend.write_answers([(data["user_id"], data["sheet"], data, False) for data in db.data["skill_answers"].values()])
+    backend.close()
+
+
+# --- アプリ操作シナリオ ---
+def _button(at, label=None, key=None):
+    for b in at.button:
+        if (key is not None and b.key == key) or (label is not None and b.label.startswith(label)):
+            return b
+    raise LookupError(label or key)
+
+
+def _check(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def interactions(at):
+    # (名前, 操作) の列。操作のあとに at.run() を呼ぶ
+    def login():
+        at.text_input(key="login_user").input(BENCH_USER)
+        at.text_input(key="login_pass").input(BENCH_PASSWORD)
+        _button(at, key="login_btn").click()
+
+    def toggle_item():
+        item = next(c for c in at.checkbox if c.key and ":" in c.key)
+        item.set_value(not item.value)
+
+    def select_all_levels():
+        at.sidebar.multiselect[0].set_value(["★", "★★", "★★★"])
+
+    def grid_mode():
+        at.radio(key="edit_style").set_value("一括編集（表）")
+
+    def change_level():
+        at.selectbox[0].select("★★")
+
+    return [
+        ("login_page", lambda: None),
+        ("login", login),
+        ("save_rerun", toggle_item),
+        ("save_all_levels", select_all_levels),
+        ("save", lambda: _button(at, label="保存").click()),
+        ("save_grid_mode", grid_mode),
+        ("open_analyze", lambda: _button(at, label="→").click()),
+        ("analyze_rerun", change_level),
+        ("open_org", lambda: _button(at, key="org_btn").click()),
+        ("org_rerun", lambda: None),
+    ]
+
+
+def run_scenario(db, workbook, users, latency, memory=True, sqlite_path=None):
+    # sqlite_path を渡すと Firestore（フェイク）の代わりに SQLite バックエンドで動かす
+    from streamlit.testing.v1 import AppTest
+
+    def prepare():
+        reset_caches()
+        seed(db, cat, users, catalog_registry.parse_version(workbook))
+        if sqlite_path:
+            seed_sqlite(db, sqlite_path)
+
+    cat = catalog.get_catalog(workbook, catalog.SHEETS)
+    prepare()
+    db.latency = latency
+
+    def counters():
+        # SQLite のシナリオではフェイクの Firestore を呼ばないので、件数は記録しない（常に 0 になる）
+        return {} if sqlite_path else db.counters()
+
+    def drive(record):
+        at = AppTest.from_file(APP_PATH, default_timeout=600)
+        at.secrets["firebase"] = {"type": "service_account"}
+        at.secrets["catalog_dir"] = os.path.dirname(workbook)
+        if sqlite_path:
+            at.secrets["storage_backend"] = "sqlite"
+            at.secrets["sqlite_path"] = sqlite_path
+        for name, action in interactions(at):
+            db.reset_counters()
+            started = time.perf_counter()
+            action()
+            at.run()
+            elapsed = time.perf_counter() - started
+            _check(at)
+            record(name, elapsed, counters())
+
+    steps = []
+    drive(lambda name, elapsed, counters: steps.append({"name": name, "wall_ms": round(elapsed * 1000, 2), **counters}))
+
+    result = {"backend": "sqlite" if sqlite_path else "firestore",
+              "items": sum(len(cat.sheet(s)) for s in cat.sheet_names), "users": users,
+              "latency_ms": latency * 1000, "steps": steps}
+    if memory:
+        # 計測のオーバーヘッドが時間に乗らないよう、メモリは別パスで測る
+        prepare()
+        tracemalloc.start()
+        drive(lambda *args: None)
+        result["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+        tracemalloc.stop()
+    return result
+
+
+# --- 単体の計測 ---
+def timed(fn, repeat=5, setup=None):
+    samples = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 3)
+
+
+def hot_paths(db, workbook):
+    reset_caches()
+    cat = catalog.get_catalog(workbook, catalog.SHEETS)
+    seed(db, cat, 1, catalog_registry.parse_version(workbook))
+    db = FirestoreBackend(db)
+    active = catalog_registry.get_registry(os.path.dirname(workbook), watch_interval=0).active
+    user_id = "user00000"
+    answers = storage.fetch_user_answers(db, user_id, catalog.SHEETS, active)
+    achievement = scoring.evaluate(cat, answers)
+
+    return {
+        "catalog_compile": timed(lambda: catalog.compile_catalog(workbook, catalog.SHEETS), repeat=2),
+        "catalog_artifact_load": timed(lambda: catalog.get_catalog(workbook, catalog.SHEETS),
+                                       setup=catalog._catalogs.clear),
+        "catalog_warm": timed(lambda: catalog.get_catalog(workbook, catalog.SHEETS)),
+        "fetch_answers_cold": timed(lambda: storage.fetch_user_answers(db, user_id, catalog.SHEETS, active),
+                                    setup=storage.answers_cache.clear),
+        "fetch_answers_warm": timed(lambda: storage.fetch_user_answers(db, user_id, catalog.SHEETS, active)),
+        "evaluate": timed(lambda: scoring.evaluate(cat, answers)),
+        "donut_cold": timed(lambda: charts.donut_chart_image(*achievement.counts()[:2], "進捗度"),
+                            setup=charts.clear_cache, repeat=3),
+        "donut_warm": timed(lambda: charts.donut_chart_image(*achievement.counts()[:2], "進捗度")),
+        "radar_cold": timed(lambda: charts.radar_chart_spec({s: achievement.rate(s) for s in catalog.SHEETS}, "t"),
+                            setup=charts.clear_cache, repeat=3),
+        "radar_warm": timed(lambda: charts.radar_chart_spec({s: achievement.rate(s) for s in catalog.SHEETS}, "t")),
+    }
+
+
+# --- 劣化検出 ---
+def compare(results, baseline, tolerance):
+    regressions = []
+    def key(s):
+        return s.get("backend", "firestore"), s["items"], s["users"], s["latency_ms"]
+
+    base_scenarios = {key(s): s for s in baseline.get("scenarios", [])}
+    for scenario in results["scenarios"]:
+        base = base_scenarios.get(key(scenario))
+        if base is None:
+            continue
+        base_steps = {s["name"]: s for s in base["steps"]}
+        for step in scenario["steps"]:
+            b = base_steps.get(step["name"])
+            if b is None:
+                continue
+            label = f"{key(scenario)[0]} items={scenario['items']} users={scenario['users']} {step['name']}"
+            if step["wall_ms"] > b["wall_ms"] * (1 + tolerance) and step["wall_ms"] - b["wall_ms"] > 5:
+                regressions.append(f"{label}: wall_ms {b['wall_ms']} -> {step['wall_ms']}")
+            if "rpcs" in step and "rpcs" in b and step["rpcs"] > b["rpcs"]:
+                regressions.append(f"{label}: rpcs {b['rpcs']} -> {step['rpcs']}")
+    for name, ms in results.get("hot_paths", {}).items():
+        b = baseline.get("hot_paths", {}).get(name)
+        if b is not None and ms > b * (1 + tolerance) and ms - b > 1:
+            regressions.append(f"hot_path {name}: {b} -> {ms} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="app.py の再実行ベンチマーク")
+    parser.add_argument("--scales", default="1,4", help="カタログの倍率（カンマ区切り）")
+    parser.add_argument("--users", default="10,1000", help="登録ユーザー数（カンマ区切り）")
+    parser.add_argument("--backends", default="firestore", help="firestore / sqlite（カンマ区切り）")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Firestore RPC ごとの遅延")
+    parser.add_argument("--output", help="結果 JSON の出力先（省略時は標準出力）")
+    parser.add_argument("--baseline", help="比較対象の結果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="許容する実行時間の増加率")
+    parser.add_argument("--no-memory", action="store_true", help="ピークメモリを測らない")
+    args = parser.parse_args(argv)
+
+    os.chdir(ROOT)  # app.py はリポジトリ直下からの相対パスでフォントを読む
+    db = FakeFirestore()
+    install_fake(db)
+
+    results = {"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "scenarios": []}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in [int(s) for s in args.scales.split(",")]:
+            workbook = make_workbook(scale, tmp)
+            for users in [int(u) for u in args.users.split(",")]:
+                for backend in args.backends.split(","):
+                    print(f"scale={scale} users={users} backend={backend} ...", file=sys.stderr)
+                    sqlite_path = os.path.join(tmp, "bench.db") if backend == "sqlite" else None
+                    results["scenarios"].append(run_scenario(db, workbook, users, args.latency_ms / 1000,
+                                                             memory=not args.no_memory, sqlite_path=sqlite_path))
+        results["hot_paths"] = hot_paths(db, str(ROOT / catalog.WORKBOOK_PATH))
+
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(text, encoding="utf-8")
+    else:
+        print(text)
+
+    if args.baseline:
+        regressions = compare(results, json.loads(Path(args.baseline).read_text(encoding="utf-8")), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
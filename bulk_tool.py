@@ -0,0 +1,214 @@
+"""回答の一括インポート / スコアの一括エクスポート（コマンドライン）。
+
+使い方:
+    python bulk_tool.py import answers.csv [--workers 8] [--dry-run]
+    python bulk_tool.py export scores.csv   # .xlsx も可
+    python bulk_tool.py export scores.csv --as-of 2024-03-31   # その日の終わり時点のスコア
+
+インポートファイル（CSV / xlsx）は1行1項目の縦持ち形式:
+    user_id, sheet, NO, achieved
+achieved は 1/0, true/false, ○/×, 達成/未達成 などを受け付ける。
+書き込みは skill_answers/{user_id}_{sheet} の既存の回答に重ねた全体（既存の他項目は保持）。
+値が変わった項目はアプリからの保存と同じく変更履歴（history.py）に記録する。
+NO は現行のカタログの版で解釈し、古い版・旧形式のドキュメントは読み替えてから書き直す。
+
+--as-of を付けたエクスポートは、各ドキュメントの回答を変更履歴（history.py）から復元する
+（ドキュメントごとに履歴を読むので通常のエクスポートより遅い）。その日までに履歴のない
+ドキュメント（履歴の記録を始める前の回答や、その日より後に初めて保存した回答）は出力しない。
+
+接続先は --sqlite の SQLite ファイル、--credentials のサービスアカウント JSON（Firestore）、
+どちらもなければ .streamlit/secrets.toml の設定（storage_backend / [firebase]）を使う。
+"""
+import argparse
+import csv
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+import history
+import storage
+from backends import FIRESTORE_BATCH_LIMIT, FirestoreBackend, SQLiteBackend
+from catalog import LEVELS
+from catalog_registry import get_registry
+from resources import get_backend, get_firestore
+from scoring import get_index
+
+IMPORT_COLUMNS = ["user_id", "sheet", "NO", "achieved"]
+EXPORT_COLUMNS = ["user_id", "sheet", "スキルレベル", "達成件数", "合計件数",
+                  "必須達成件数", "必須合計件数", "点数", "満点"]
+TRUE_VALUES = {"1", "true", "yes", "y", "○", "◯", "✓", "✔", "達成", "済"}
+FALSE_VALUES = {"0", "false", "no", "n", "×", "", "未達成", "未", "nan"}
+
+CHUNK_ROWS = 50_000
+
+
+# --- インポート ---
+def read_rows(path, chunk_rows=CHUNK_ROWS):
+    # CSV はチャンク単位で読み、メモリ使用量を一定に保つ
+    if path.lower().endswith((".xlsx", ".xlsm", ".xls")):
+        yield pd.read_excel(path, dtype=str)
+    else:
+        yield from pd.read_csv(path, dtype=str, chunksize=chunk_rows, keep_default_na=False)
+
+
+def parse_achieved(value):
+    v = str(value).strip().lower()
+    if v in TRUE_VALUES:
+        return True
+    if v in FALSE_VALUES:
+        return False
+    raise ValueError(f"achieved の値を解釈できません: {value!r}")
+
+
+def group_chunk(df, valid_nos, errors):
+    # { (user_id, sheet): { str(NO): achieved } }（同じ項目が重複した場合は後の行を採用）
+    missing = [c for c in IMPORT_COLUMNS if c not in df.columns]
+    if missing:
+        raise SystemExit(f"必要な列がありません: {', '.join(missing)}")
+
+    groups = {}
+    for user_id, sheet, no, achieved in df[IMPORT_COLUMNS].itertuples(index=False):
+        user_id, sheet, no = str(user_id).strip(), str(sheet).strip(), str(no).strip()
+        if no.endswith(".0"):
+            no = no[:-2]
+        try:
+            if not user_id:
+                raise ValueError("user_id が空です")
+            if no not in valid_nos.get(sheet, ()):
+                raise ValueError(f"シート {sheet!r} に NO {no!r} はありません")
+            groups.setdefault((user_id, sheet), {})[no] = parse_achieved(achieved)
+        except ValueError as e:
+            errors.append(str(e))
+    return groups
+
+
+def commit_groups(db, groups, workers, catalog_version):
+    # Firestore のトランザクション上限（500件）ごとに分けて並列にコミットする
+    items = [(user_id, sheet, changes) for (user_id, sheet), changes in groups.items()]
+
+    def commit(chunk):
+        # 既存の回答（古い版・旧形式は現行の版に読み替える）に重ね、現行の版のビット列で全体を書き直す。
+        # 読み込みから書き込みまでを1トランザクションで行うので、その間にアプリで保存された回答も消えない。
+        # アプリの保存と同じく、値が変わったドキュメントは保存フックで変更履歴・日次集計に残す
+        storage.commit_changes(db, chunk, catalog_version, remember=False)
+        return len(chunk)
+
+    chunks = [items[i:i + FIRESTORE_BATCH_LIMIT] for i in range(0, len(items), FIRESTORE_BATCH_LIMIT)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(commit, chunks))
+
+
+def run_import(db, path, workers=8, dry_run=False, max_errors=20):
+    catalog_version = get_registry(watch_interval=0).active
+    valid_nos = {name: set(si.keys) for name, si in get_index(catalog_version.catalog).items()}
+
+    started = time.monotonic()
+    rows = documents = 0
+    errors = []
+    # チャンクごとにコミットを完了させてから次を読む（同じ項目の新しい行が後に書かれる）
+    for df in read_rows(path):
+        rows += len(df)
+        groups = group_chunk(df, valid_nos, errors)
+        documents += len(groups) if dry_run else commit_groups(db, groups, workers, catalog_version)
+        print(f"  {rows} 行 / {documents} ドキュメント ({time.monotonic() - started:.1f}s)", file=sys.stderr)
+
+    for message in errors[:max_errors]:
+        print(f"  スキップ: {message}", file=sys.stderr)
+    if len(errors) > max_errors:
+        print(f"  ...ほか {len(errors) - max_errors} 件", file=sys.stderr)
+    print(f"インポート{'（dry-run）' if dry_run else ''}: {rows} 行, {documents} ドキュメント, "
+          f"スキップ {len(errors)} 行, {time.monotonic() - started:.1f}s", file=sys.stderr)
+    return documents
+
+
+# --- エクスポート ---
+def parse_as_of(value):
+    # "YYYY-MM-DD" → その日の終わり（ローカル時刻、タイムゾーン付き）
+    return (datetime.strptime(value, "%Y-%m-%d") + timedelta(days=1, microseconds=-1)).astimezone()
+
+
+def iter_score_rows(db, page_size, as_of=None):
+    # skill_answers を1ページずつ読み、ドキュメントごとにレベル別スコアを出す
+    # （as_of を指定すると、その時点の回答を履歴から復元して使う）
+    catalog_version = get_registry(watch_interval=0).active
+    index = get_index(catalog_version.catalog)
+    for data in db.iter_answers(page_size):
+        si = index.get(data.get("sheet"))
+        if si is None or not data.get("user_id"):
+            continue
+        if as_of is None:
+            answers = storage.doc_answers(data, catalog_version)
+        else:
+            answers = history.state_at(db, data["user_id"], data["sheet"], catalog_version, as_of)
+            if answers is None:
+                continue
+        result = si.evaluate(si.pack(answers))
+        for level in LEVELS:
+            achieved, total, required_achieved, required_total = result.counts(level)
+            if total == 0:
+                continue
+            # スコア計算（必須は+1点ボーナス）
+            yield [data["user_id"], data["sheet"], level, achieved, total, required_achieved,
+                   required_total, achieved + required_achieved, total + required_total]
+
+
+def run_export(db, path, page_size=500, as_of=None):
+    started = time.monotonic()
+    rows = 0
+    if path.lower().endswith(".xlsx"):
+        from openpyxl import Workbook
+        wb = Workbook(write_only=True)  # 行を溜めずに書き出す
+        ws = wb.create_sheet("scores")
+        ws.append(EXPORT_COLUMNS)
+        for row in iter_score_rows(db, page_size, as_of):
+            ws.append(row)
+            rows += 1
+        wb.save(path)
+    else:
+        with open(path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_COLUMNS)
+            for row in iter_score_rows(db, page_size, as_of):
+                writer.writerow(row)
+                rows += 1
+    print(f"エクスポート: {rows} 行 → {path} ({time.monotonic() - started:.1f}s)", file=sys.stderr)
+    return rows
+
+
+def connect(args):
+    if args.sqlite:
+        return SQLiteBackend(args.sqlite)
+    if args.credentials:
+        return FirestoreBackend(get_firestore(args.credentials))
+    return get_backend()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="スキルチェック回答の一括インポート / エクスポート")
+    parser.add_argument("--credentials", help="サービスアカウント JSON（省略時は .streamlit/secrets.toml）")
+    parser.add_argument("--sqlite", help="Firestore の代わりに使う SQLite ファイル")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import", help="CSV / xlsx から回答を一括登録する")
+    p_import.add_argument("path")
+    p_import.add_argument("--workers", type=int, default=8, help="並列コミット数")
+    p_import.add_argument("--dry-run", action="store_true", help="検証のみ行い書き込まない")
+
+    p_export = sub.add_parser("export", help="ユーザー別・シート別・レベル別のスコアを書き出す")
+    p_export.add_argument("path")
+    p_export.add_argument("--page-size", type=int, default=500)
+    p_export.add_argument("--as-of", type=parse_as_of, help="この日（YYYY-MM-DD）の終わり時点のスコアを出す")
+
+    args = parser.parse_args(argv)
+    if args.command == "import":
+        db = None if args.dry_run else connect(args)
+        run_import(db, args.path, workers=args.workers, dry_run=args.dry_run)
+    else:
+        run_export(connect(args), args.path, page_size=args.page_size, as_of=args.as_of)
+
+
+if __name__ == "__main__":
+    main()
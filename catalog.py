@@ -0,0 +1,236 @@
+"""スキルチェックシート（xlsx）のコンパイル済みカタログ。
+
+ワークブックは内容ハッシュをキーに一度だけ解析し、列指向の配列
+（NO / カテゴリ / サブカテゴリ / レベル / 必須）と文字列テーブルを
+バイナリ（.npz）に保存する。プロセス内では全セッションで共有する。
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# アプリ・CLI 共通のワークブックと対象シート
+WORKBOOK_PATH = "skillcheck_ver5.00_simple.xlsx"
+SHEETS = ["ビジネス力","データサイエンス力", "データエンジニアリング力"]
+
+COLUMNS = ["NO", "スキルカテゴリ", "サブカテゴリ", "スキルレベル", "チェック項目", "必須"]
+LEVELS = ["★", "★★", "★★★"]
+
+# 成果物フォーマットを変えたら上げる（古いキャッシュは自動的に無視される）
+ARTIFACT_VERSION = 2
+CACHE_DIR_NAME = ".catalog_cache"
+
+
+class SheetCatalog:
+    """1シート分の列指向データ。文字列列は Catalog.strings へのインデックス。"""
+
+    __slots__ = ("name", "no", "category", "subcategory", "level", "item",
+                 "required", "strings", "_frame")
+
+    def __init__(self, name, no, category, subcategory, level, item, required, strings):
+        self.name = name
+        self.no = no
+        self.category = category
+        self.subcategory = subcategory
+        self.level = level
+        self.item = item
+        self.required = required
+        self.strings = strings
+        self._frame = None
+
+    def __len__(self):
+        return len(self.no)
+
+    def frame(self) -> pd.DataFrame:
+        # 既存コード向けの DataFrame 表現（初回のみ組み立てる。呼び出し側は変更しないこと）
+        if self._frame is None:
+            table = self.strings.copy()
+            table[0] = None  # 空セルは元の read_excel と同じく欠損値に戻す
+            self._frame = pd.DataFrame({
+                "NO": self.no.astype(np.int64),
+                "スキルカテゴリ": table[self.category],
+                "サブカテゴリ": table[self.subcategory],
+                "スキルレベル": table[self.level],
+                "チェック項目": table[self.item],
+                "必須": self.required.copy(),
+            })
+        return self._frame
+
+
+class Catalog:
+    def __init__(self, digest, sheets, strings):
+        self.digest = digest
+        self.sheets = sheets  # {sheet_name: SheetCatalog}
+        self.strings = strings
+
+    @property
+    def sheet_names(self):
+        return list(self.sheets)
+
+    def sheet(self, sheet_name) -> SheetCatalog:
+        return self.sheets[sheet_name]
+
+    def frame(self, sheet_name) -> pd.DataFrame:
+        return self.sheets[sheet_name].frame()
+
+
+# --- ワークブック解析 ---
+def compile_catalog(file_path, sheet_names, digest=None) -> Catalog:
+    if digest is None:
+        digest = file_digest(file_path)
+
+    # 文字列はシート横断で1つのテーブルに intern する
+    intern = {"": 0}
+    def codes(values):
+        out = np.empty(len(values), dtype=np.int32)
+        for i, v in enumerate(values):
+            s = "" if pd.isna(v) else str(v)
+            code = intern.get(s)
+            if code is None:
+                code = intern[s] = len(intern)
+            out[i] = code
+        return out
+
+    columns = {}
+    frames = pd.read_excel(file_path, sheet_name=list(sheet_names), skiprows=2)
+    for sheet_name in sheet_names:
+        df = frames[sheet_name][COLUMNS].dropna(subset=["チェック項目"])
+        columns[sheet_name] = (
+            df["NO"].to_numpy(dtype=np.int32),
+            codes(df["スキルカテゴリ"].tolist()),
+            codes(df["サブカテゴリ"].tolist()),
+            codes(df["スキルレベル"].tolist()),
+            codes(df["チェック項目"].tolist()),
+            df["必須"].fillna(False).astype(bool).to_numpy(),
+        )
+
+    strings = np.array(list(intern), dtype=object)
+    sheets = {name: SheetCatalog(name, *cols, strings) for name, cols in columns.items()}
+    return Catalog(digest, sheets, strings)
+
+
+# --- バイナリ成果物（.npz, pickle 不使用） ---
+def save_artifact(catalog: Catalog, path):
+    arrays = {
+        "version": np.array([ARTIFACT_VERSION]),
+        "sheet_names": np.array(catalog.sheet_names, dtype=str),
+    }
+    # 文字列テーブルは UTF-8 連結 + オフセットで保存する（固定長 Unicode 配列より小さい）
+    encoded = [s.encode("utf-8") for s in catalog.strings]
+    arrays["strings_blob"] = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    arrays["strings_offsets"] = np.cumsum([0] + [len(b) for b in encoded], dtype=np.int64)
+    for i, sc in enumerate(catalog.sheets.values()):
+        arrays[f"s{i}_no"] = sc.no
+        arrays[f"s{i}_category"] = sc.category
+        arrays[f"s{i}_subcategory"] = sc.subcategory
+        arrays[f"s{i}_level"] = sc.level
+        arrays[f"s{i}_item"] = sc.item
+        arrays[f"s{i}_required"] = sc.required
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)  # 並行プロセスがあっても中途半端なファイルは見えない
+
+
+def load_artifact(path, digest) -> Catalog:
+    with np.load(path, allow_pickle=False) as data:
+        if int(data["version"][0]) != ARTIFACT_VERSION:
+            raise ValueError(f"catalog artifact version mismatch: {path}")
+        blob = data["strings_blob"].tobytes()
+        offsets = data["strings_offsets"].tolist()
+        strings = np.array(
+            [blob[offsets[i]:offsets[i + 1]].decode("utf-8") for i in range(len(offsets) - 1)],
+            dtype=object,
+        )
+        sheets = {}
+        for i, name in enumerate(data["sheet_names"].tolist()):
+            sheets[name] = SheetCatalog(
+                name,
+                data[f"s{i}_no"], data[f"s{i}_category"], data[f"s{i}_subcategory"],
+                data[f"s{i}_level"], data[f"s{i}_item"], data[f"s{i}_required"],
+                strings,
+            )
+    return Catalog(digest, sheets, strings)
+
+
+# --- 内容ハッシュ（stat が変わらない限り再計算しない） ---
+_digest_cache = {}
+
+def file_digest(file_path) -> str:
+    stat = os.stat(file_path)
+    key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+    digest = _digest_cache.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _digest_cache[key] = h.hexdigest()
+    return digest
+
+
+def cache_dir(directory) -> str:
+    # ワークブックと同じディレクトリに置く成果物のディレクトリ
+    return os.path.join(os.path.abspath(directory), CACHE_DIR_NAME)
+
+
+def _artifact_in(directory, sheet_names, digest) -> str:
+    sheets_key = hashlib.sha256("\0".join(sheet_names).encode()).hexdigest()[:8]
+    return os.path.join(cache_dir(directory), f"{digest[:32]}_{sheets_key}_v{ARTIFACT_VERSION}.npz")
+
+
+def artifact_path(file_path, sheet_names, digest) -> str:
+    return _artifact_in(os.path.dirname(os.path.abspath(file_path)), sheet_names, digest)
+
+
+# --- プロセス共有キャッシュ ---
+_lock = threading.Lock()
+_catalogs = {}
+
+def get_catalog(file_path, sheet_names) -> Catalog:
+    sheet_names = tuple(sheet_names)
+    digest = file_digest(file_path)
+    key = (digest, sheet_names)
+    catalog = _catalogs.get(key)
+    if catalog is not None:
+        return catalog
+
+    with _lock:
+        catalog = _catalogs.get(key)
+        if catalog is None:
+            path = artifact_path(file_path, sheet_names, digest)
+            if os.path.exists(path):
+                try:
+                    catalog = load_artifact(path, digest)
+                except (OSError, ValueError, KeyError):
+                    catalog = None  # 壊れた成果物は作り直す
+            if catalog is None:
+                catalog = compile_catalog(file_path, sheet_names, digest)
+                try:
+                    save_artifact(catalog, path)
+                except OSError:
+                    pass  # 読み取り専用環境ではメモリ上のみで運用
+            _catalogs[key] = catalog
+    return catalog
+
+
+def get_compiled_catalog(directory, sheet_names, digest) -> Catalog:
+    # 以前にコンパイルした成果物から読む（ワークブックが消えていてもよい）。成果物もなければ FileNotFoundError
+    sheet_names = tuple(sheet_names)
+    key = (digest, sheet_names)
+    catalog = _catalogs.get(key)
+    if catalog is None:
+        with _lock:
+            catalog = _catalogs.get(key)
+            if catalog is None:
+                path = _artifact_in(directory, sheet_names, digest)
+                try:
+                    catalog = load_artifact(path, digest)
+                except (ValueError, KeyError) as e:
+                    raise FileNotFoundError(f"catalog artifact is unreadable: {path}") from e
+                _catalogs[key] = catalog
+    return catalog
@@ -0,0 +1,302 @@
+"""スキルチェックシートのバージョン管理（カタログレジストリ）。
+
+ディレクトリ内の skillcheck_ver*.xlsx をバージョンとして扱い、最も新しい版を現行カタログにする。
+新しいワークブックが置かれたらバックグラウンドでコンパイルしてから現行を差し替える
+（参照の付け替えだけなので、実行中の再実行は取得済みのカタログのまま最後まで動く）。
+
+skill_answers は保存時のバージョンを catalog_version に持つ。回答ドキュメントは読み込み時に
+現行の版の SheetAnswers（カタログ順のビット列）にする。古い版の回答は項目の対応表
+（旧 NO → 現行 NO）で読み替え、次の保存で現行の版で書き直す（一括移行はしない）。
+NO を振り直す改訂は、同じファイルの上書きではなく新しいバージョン番号のファイルとして置くこと
+（同じ版のファイルが項目の並びを変えて上書きされたら、ログに残して元の並びのまま使い続ける）。
+
+見つけた版はすべてコンパイルし、版 → 内容ハッシュの対応を .catalog_cache/versions.json に残す。
+古い版のワークブックをディレクトリから消しても、その版の回答はコンパイル済みの成果物から読み替えられる。
+どの版か分からない回答は読み込みでは空として扱い、保存では上書きせずに UnknownCatalogVersion にする。
+
+版はプロセスのグローバルには持たない。読み書きする側は再実行（処理）の最初に registry.active を
+1回だけ取得し、その CatalogVersion で回答の読み込み（decode_answers）と保存時の版付けを行う
+（差し替えの途中に走っている保存が、旧版の NO を新しい版として書くことはない）。
+"""
+import glob
+import json
+import logging
+import os
+import re
+import threading
+import time
+
+import storage
+from catalog import SHEETS, cache_dir, get_catalog, get_compiled_catalog
+from scoring import SheetAnswers, get_index
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DIR = "."
+WORKBOOK_PATTERN = "skillcheck_ver*.xlsx"
+# catalog_version を持たない（バージョン管理を入れる前の）回答ドキュメントの版
+LEGACY_VERSION = "5.00"
+# 新しいワークブックを探す間隔（秒）
+WATCH_INTERVAL = 60.0
+
+_VERSION_RE = re.compile(r"ver(\d+(?:\.\d+)*)")
+MANIFEST_NAME = "versions.json"
+
+
+class UnknownCatalogVersion(LookupError):
+    """回答ドキュメントの版のカタログ（ワークブックもコンパイル済みの成果物も）が見つからない、
+    またはビット列がその版の並びと合わない。"""
+
+
+def parse_version(path):
+    # "skillcheck_ver5.00_simple.xlsx" → "5.00"
+    m = _VERSION_RE.search(os.path.basename(path))
+    return m.group(1) if m else None
+
+
+def version_key(version):
+    return tuple(int(part) for part in version.split("."))
+
+
+# --- NO の対応表 ---
+def _item_keys(sheet_catalog):
+    # 項目の同一性は カテゴリ・サブカテゴリ・レベル・項目文 の組で判定する
+    sc = sheet_catalog
+    s = sc.strings
+    return list(zip(s[sc.category].tolist(), s[sc.subcategory].tolist(), s[sc.level].tolist(),
+                    [text.strip() for text in s[sc.item].tolist()]))
+
+
+def _layout(catalog) -> dict:
+    # ビット列の並び（シートごとのカタログ順の NO）
+    return {name: si.keys for name, si in get_index(catalog).items()}
+
+
+def build_remap(old_sheet, new_sheet) -> dict:
+    # { 旧 str(NO): 新 str(NO) }。新しい版で廃止された項目の NO は含めない
+    exact = {}
+    by_text = {}
+    for key, no in zip(_item_keys(new_sheet), new_sheet.no.tolist()):
+        exact.setdefault(key, str(no))
+        by_text.setdefault(key[3], []).append(str(no))
+
+    remap = {}
+    for key, no in zip(_item_keys(old_sheet), old_sheet.no.tolist()):
+        new_no = exact.get(key)
+        if new_no is None:
+            # カテゴリやレベルの付け替えだけなら項目文で対応づける（同じ文の項目が複数あれば諦める）
+            candidates = by_text.get(key[3], ())
+            if len(candidates) == 1:
+                new_no = candidates[0]
+        if new_no is not None:
+            remap[str(no)] = new_no
+    return remap
+
+
+class CatalogVersion:
+    """1つの版のカタログ。回答の読み書きはこの版に結びつけて行う（再実行の最初に1回だけ取得して使い回す）。"""
+
+    __slots__ = ("version", "path", "catalog", "registry")
+
+    def __init__(self, version, path, catalog, registry=None):
+        self.version = version
+        self.path = path
+        self.catalog = catalog
+        self.registry = registry
+
+    def decode_answers(self, data, strict=False):
+        # 回答ドキュメント → この版の SheetAnswers（保存時の版に付ける version と対になる）
+        return self.registry.decode_answers(data, self, strict)
+
+
+class CatalogRegistry:
+    """ディレクトリ内のワークブック（版ごと）と現行カタログの管理。"""
+
+    def __init__(self, directory=CATALOG_DIR, pattern=WORKBOOK_PATTERN, sheet_names=SHEETS):
+        self.directory = directory
+        self.pattern = pattern
+        self.sheet_names = tuple(sheet_names)
+        self.paths = {}  # { version: path }（いまディレクトリにあるワークブック）
+        self.digests = self._read_manifest()  # { version: 内容ハッシュ }（これまでに見つけたすべての版）
+        self.active = None  # CatalogVersion（読む側は1回だけ参照して使い回すこと）
+        self.swap_listeners = []
+        self._lock = threading.Lock()
+        self._remaps = {}
+        self._watcher = None
+
+    def discover(self) -> dict:
+        found = {}
+        for path in glob.glob(os.path.join(self.directory, self.pattern)):
+            version = parse_version(path)
+            if version is not None:
+                found[version] = path
+        return found
+
+    # --- 版 → 内容ハッシュ（ワークブックを消した版も読めるように残す） ---
+    def _manifest_path(self):
+        return os.path.join(cache_dir(self.directory), MANIFEST_NAME)
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path(), encoding="utf-8") as f:
+                return dict(json.load(f))
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self, digests):
+        path = self._manifest_path()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(digests, f, indent=1, sort_keys=True)
+            os.replace(tmp_path, path)
+        except OSError:
+            logger.warning("could not write %s; past catalog versions are kept in memory only", path)
+
+    def _pin(self, found) -> dict:
+        # 見つけた版をコンパイルし、版ごとの内容ハッシュを決める。
+        # 同じ版のファイルの変更は、ビット列の並びが変わらない（項目文の修正など）ときだけ取り込む
+        digests = dict(self.digests)
+        for version, path in found.items():
+            catalog = get_catalog(path, self.sheet_names)
+            pinned = digests.get(version)
+            if pinned == catalog.digest:
+                continue
+            if pinned is not None:
+                try:
+                    previous = get_compiled_catalog(self.directory, self.sheet_names, pinned)
+                except FileNotFoundError:
+                    previous = None  # 以前の成果物がなければ比べようがないので新しい内容を使う
+                if previous is not None and _layout(previous) != _layout(catalog):
+                    logger.error("%s changes the item layout of catalog version %s; keeping the previous "
+                                 "layout (save the revision as a new version instead)", path, version)
+                    continue
+            digests[version] = catalog.digest
+        return digests
+
+    def refresh(self) -> bool:
+        # より新しい版（または現行ファイルの更新）があればコンパイルして差し替える。差し替えたら True
+        found = self.discover()
+        if not found:
+            if self.active is None:
+                raise FileNotFoundError(f"{self.pattern} が見つかりません: {self.directory}")
+            return False
+        latest = max(found, key=version_key)
+        # コンパイルと索引の作成はロックの外で済ませる（成果物はディスクにキャッシュされる）
+        digests = self._pin(found)
+        if digests != self.digests:
+            self._write_manifest(digests)
+        catalog = get_compiled_catalog(self.directory, self.sheet_names, digests[latest])
+        get_index(catalog)
+        with self._lock:
+            self.paths = found
+            self.digests = digests
+            current = self.active
+            if current is not None and current.version == latest and current.catalog is catalog:
+                return False
+            self.active = active = CatalogVersion(latest, found[latest], catalog, self)
+            self._remaps.clear()
+        logger.info("catalog version %s is now active (%s)", latest, found[latest])
+        for listener in self.swap_listeners:
+            listener(active)
+        return True
+
+    def catalog(self, version):
+        # 古い版は、その版の回答を読み替えるときに初めて（コンパイル済みの成果物から）読み込む
+        digest = self.digests.get(version)
+        if digest is None:
+            raise UnknownCatalogVersion(version)
+        try:
+            return get_compiled_catalog(self.directory, self.sheet_names, digest)
+        except FileNotFoundError as e:
+            raise UnknownCatalogVersion(version) from e
+
+    def remap(self, sheet, from_version, active=None) -> dict:
+        active = active or self.active
+        key = (from_version, active.version, sheet)
+        remap = self._remaps.get(key)
+        if remap is None:
+            remap = build_remap(self.catalog(from_version).sheet(sheet), active.catalog.sheet(sheet))
+            self._remaps[key] = remap
+        return remap
+
+    def translate_answers(self, sheet, answers, from_version, active=None):
+        # 回答 { str(NO): bool } を active（省略時は現行）の版の NO に読み替える（同じ版ならそのまま返す）。
+        # from_version のカタログがなければ UnknownCatalogVersion
+        active = active or self.active
+        from_version = from_version or LEGACY_VERSION
+        if from_version == active.version or sheet not in active.catalog.sheets:
+            return answers
+        remap = self.remap(sheet, from_version, active)
+        return {remap[no]: achieved for no, achieved in answers.items() if no in remap}
+
+    def decode_answers(self, data, active=None, strict=False):
+        # 回答ドキュメント → active（省略時は現行）の版の SheetAnswers（カタログにないシートは dict のまま）。
+        # 版が分からない回答は空として読む。strict なら UnknownCatalogVersion（上書きして消さないため）
+        active = active or self.active
+        sheet = data.get("sheet")
+        si = get_index(active.catalog).get(sheet)
+        if si is None:
+            return data.get("answers", {})
+        version = data.get("catalog_version") or LEGACY_VERSION
+        bits = data.get("bits")
+        try:
+            if bits is None:
+                # 旧形式（{str(NO): bool} のマップ）
+                answers = data.get("answers", {})
+            elif version == active.version:
+                try:
+                    return SheetAnswers.from_bytes(si, bits)  # 項目ごとの変換なしでそのまま使う
+                except ValueError as e:
+                    raise UnknownCatalogVersion(version) from e  # 並びの違う同じ版で書かれた
+            else:
+                answers = get_index(self.catalog(version))[sheet].unpack(bits)
+            return SheetAnswers.from_dict(si, self.translate_answers(sheet, answers, version, active))
+        except UnknownCatalogVersion:
+            if strict:
+                raise
+            logger.warning("catalog version %s is not available; ignoring answers of %s/%s",
+                           version, data.get("user_id"), sheet)
+            return SheetAnswers.empty(si)
+
+    # --- 監視 ---
+    def _watch(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("catalog refresh failed; keeping version %s",
+                                 self.active.version if self.active else None)
+
+    def start_watching(self, interval=WATCH_INTERVAL):
+        with self._lock:
+            if self._watcher is None:
+                self._watcher = threading.Thread(target=self._watch, args=(interval,), daemon=True)
+                self._watcher.start()
+
+
+def _release_cache(active):
+    # 旧版で読み込んだ回答のキャッシュを手放す（キャッシュは版ごとに持つので、消さなくても混ざりはしない）
+    storage.answers_cache.clear()
+
+
+# --- プロセス共有のレジストリ ---
+_lock = threading.Lock()
+_registries = {}
+
+def get_registry(directory=CATALOG_DIR, watch_interval=WATCH_INTERVAL) -> CatalogRegistry:
+    # 初回だけ同期で走査し、以降の新しい版の取り込みは監視スレッドに任せる
+    registry = _registries.get(directory)
+    if registry is None:
+        with _lock:
+            registry = _registries.get(directory)
+            if registry is None:
+                registry = CatalogRegistry(directory)
+                registry.swap_listeners.append(_release_cache)
+                registry.refresh()
+                if watch_interval:
+                    registry.start_watching(watch_interval)
+                _registries[directory] = registry
+    return registry
@@ -0,0 +1,87 @@
+"""グラフ描画レイヤー（描画結果のキャッシュつき）。
+
+ドーナツグラフは描画に効く入力（達成件数・合計件数・中央ラベル）をキーに
+PNG/SVG のバイト列を LRU キャッシュする。pyplot のグローバルな図管理を通さず
+Figure を直接作るので、描画後に図がプロセスに残ることはない。
+レーダーチャートは Plotly の図の JSON をキャッシュし、呼び出しごとに dict で返す。
+draw_donut / draw_radar は既存の Axes に描く版（PDF レポート用）。
+matplotlib / plotly は初めて描画するときに import する（ログイン画面では読み込まない）。
+"""
+import io
+import json
+from functools import lru_cache
+
+from resources import configure_fonts
+
+DONUT_COLORS = ["#99CCFF", "#D7D7D7"]
+RADAR_COLOR = "#636EFA"  # Plotly の既定の1色目
+CACHE_SIZE = 256
+
+
+# --- ドーナツグラフ ---
+@lru_cache(maxsize=CACHE_SIZE)
+def donut_chart_image(achieved_count, total_count, label, fmt="png") -> bytes:
+    # label は中央に表示する見出し（例: "進捗度", "達成度"）
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    configure_fonts()
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    draw_donut(fig.subplots(), achieved_count, total_count, label)
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format=fmt, dpi=200, bbox_inches="tight")
+    fig.clear()
+    return buf.getvalue()
+
+
+def draw_donut(ax, achieved_count, total_count, label, fontsize=16):
+    # 既存の Axes に描く（PDF レポートでも同じ見た目にする）
+    ax.pie([achieved_count, total_count - achieved_count], startangle=90, counterclock=False,
+           colors=DONUT_COLORS, wedgeprops=dict(width=0.35))
+    ax.axis("equal")
+    progress = (achieved_count / total_count) * 100 if total_count > 0 else 0
+    ax.text(0, 0, f"{label}\n{progress:.0f}%", ha="center", va="center", fontsize=fontsize, fontweight="bold", color="black")
+
+
+# --- レーダーチャート ---
+@lru_cache(maxsize=CACHE_SIZE)
+def _radar_chart_json(categories, values, title) -> str:
+    import plotly.express as px
+    import plotly.io as pio
+
+    fig = px.line_polar({"category": list(categories), "value": list(values)}, r="value", theta="category",
+                        line_close=True, markers=True, range_r=[0,100])
+    fig.update_traces(fill="toself")
+    fig.update_layout(polar=dict(radialaxis=dict(visible=True, range=[0,100])),
+                      showlegend=False,
+                      title=title)
+    return pio.to_json(fig, validate=False)
+
+
+def radar_chart_spec(scores, title) -> dict:
+    # scores: { 軸ラベル: 達成率(%) }。戻り値は st.plotly_chart にそのまま渡せる図の dict
+    return json.loads(_radar_chart_json(tuple(scores), tuple(float(v) for v in scores.values()), title))
+
+
+def draw_radar(ax, scores, title):
+    # matplotlib 版（PDF レポート用）。ax は極座標の Axes。見た目は Plotly 版に合わせる
+    import numpy as np
+
+    labels = list(scores)
+    values = [float(v) for v in scores.values()]
+    angles = np.linspace(0, 2 * np.pi, len(labels), endpoint=False).tolist()
+    ax.set_theta_offset(np.pi / 2)
+    ax.set_theta_direction(-1)
+    ax.plot(angles + angles[:1], values + values[:1], marker="o", color=RADAR_COLOR)
+    ax.fill(angles + angles[:1], values + values[:1], color=RADAR_COLOR, alpha=0.25)
+    ax.set_xticks(angles)
+    ax.set_xticklabels(labels)
+    ax.set_ylim(0, 100)
+    ax.set_title(title, pad=20)
+
+
+def clear_cache():
+    donut_chart_image.cache_clear()
+    _radar_chart_json.cache_clear()
@@ -0,0 +1,117 @@
+"""回答の変更履歴（差分 + チェックポイント）と日次の達成度ロールアップ。
+
+保存の書き込みが済むたびに、前回から値が変わった項目の NO だけを履歴に追記する（回答全体は複製しない）。
+(ユーザー, シート) ごとに各プロセスで1日1回は保存後の全状態（達成済みの NO）を
+チェックポイントとして付けるので、任意の時点の状態は直前のチェックポイントに
+その後の差分を当てるだけで復元できる（state_at。bulk_tool.py export --as-of が使う）。
+あわせて、その日の最終状態のレベル別件数を日次ロールアップとして上書きする。
+推移グラフはロールアップだけを読み、履歴は再生しない。
+"""
+import logging
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import storage
+from catalog import LEVELS
+from scoring import ALL, SheetAnswers, get_index
+
+logger = logging.getLogger(__name__)
+
+# チェックポイントを書いた (日付, カタログの版) { (user_id, sheet): (day, version) }
+_checkpoints = storage.TTLCache(maxsize=8192, ttl=86400.0)
+# { user_id: { (sheet, day): levels } }（保存時にライトスルー）
+rollup_cache = storage.TTLCache(maxsize=2048, ttl=600.0)
+
+
+def level_counts(sheet, answers, catalog_version):
+    # { レベル: [達成件数, 合計件数] }（catalog_version のカタログにないシートは None）
+    if catalog_version is None or sheet not in catalog_version.catalog.sheets:
+        return None
+    si = get_index(catalog_version.catalog)[sheet]
+    result = si.evaluate(si.pack(answers))
+    return {level: list(result.counts(level)[:2]) for level in LEVELS}
+
+
+# --- 記録（storage の保存フック） ---
+def _on_save(db, user_id, sheet, answers, changes, catalog_version):
+    now = datetime.now(timezone.utc)
+    day = now.astimezone().date().isoformat()
+    version = catalog_version and catalog_version.version
+    entry = {
+        "user_id": user_id,
+        "sheet": sheet,
+        "at": now,
+        "catalog_version": version,
+        "checkpoint": False,
+        "flipped": list(changes),
+    }
+    # 日が変わった・版が変わった・このプロセスで初めての保存ならチェックポイントにする
+    checkpoint = (day, version)
+    if _checkpoints.get((user_id, sheet)) != checkpoint:
+        entry["checkpoint"] = True
+        if isinstance(answers, SheetAnswers):
+            entry["achieved"] = answers.achieved_keys()
+        else:
+            entry["achieved"] = [no for no, achieved in answers.items() if achieved]
+
+    rollups = []
+    levels = level_counts(sheet, answers, catalog_version)
+    if levels is not None:
+        rollups.append({"user_id": user_id, "sheet": sheet, "day": day, "levels": levels})
+
+    try:
+        db.append_history([entry], rollups)
+    except Exception:
+        # 履歴の書き込みに失敗しても保存そのものは成功させる（次の保存でチェックポイントを付け直す）
+        logger.exception("failed to record history for %s/%s", user_id, sheet)
+        _checkpoints.pop((user_id, sheet))
+        return
+    if entry["checkpoint"]:
+        _checkpoints.set((user_id, sheet), checkpoint)
+    cached = rollup_cache.get(user_id)
+    if cached is not None and levels is not None:
+        rollup_cache.set(user_id, {**cached, (sheet, day): levels})
+
+storage.save_listeners.append(_on_save)
+
+
+# --- 復元 ---
+def state_at(db, user_id, sheet, catalog_version, when=None):
+    # when（タイムゾーン付き）時点の回答（catalog_version の版の SheetAnswers）。履歴がなければ None
+    entries = db.get_history(user_id, sheet, until=when)
+    if not entries:
+        return None
+    achieved = set(entries[0]["achieved"])
+    for entry in entries[1:]:
+        achieved.symmetric_difference_update(entry["flipped"])
+    return storage.doc_answers({
+        "sheet": sheet,
+        "answers": dict.fromkeys(achieved, True),
+        "catalog_version": entries[-1].get("catalog_version"),
+    }, catalog_version)
+
+
+# --- 推移 ---
+def fetch_rollups(db, user_id) -> dict:
+    rollups = rollup_cache.get(user_id)
+    if rollups is None:
+        rollups = {(r["sheet"], r["day"]): r["levels"] for r in db.get_rollups(user_id)}
+        rollup_cache.set(user_id, rollups)
+    return rollups
+
+
+def trend_frame(rollups, level=ALL, sheets=None) -> pd.DataFrame:
+    # 行 = 日付、列 = シート、値 = 達成率(%)。保存のない日は前の値を引き継ぐ
+    records = []
+    for (sheet, day), levels in rollups.items():
+        if sheets is not None and sheet not in sheets:
+            continue
+        counts = [levels.get(lv, [0, 0]) for lv in (LEVELS if level == ALL else [level])]
+        achieved, total = sum(c[0] for c in counts), sum(c[1] for c in counts)
+        if total:
+            records.append((pd.Timestamp(day), sheet, achieved / total * 100))
+    if not records:
+        return pd.DataFrame()
+    df = pd.DataFrame(records, columns=["日付", "シート", "達成率(%)"])
+    return df.pivot(index="日付", columns="シート", values="達成率(%)").sort_index().ffill()
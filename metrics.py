@@ -0,0 +1,221 @@
+"""ホットパスの計測（タイミングスパン + Firestore 呼び出しメトリクス）。
+
+configure(enabled=True) のときだけ計測する。無効時の span() は共有の
+nullcontext を返し、timed() はフラグを1回見るだけなので、オーバーヘッドはほぼない。
+計測値はプロセス単位で名前ごとのヒストグラム（対数バケット）に集約する。
+再実行（rerun）ごとのスパン合計は構造化ログ（JSON 1行）として出力できる。
+"""
+import contextlib
+import functools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケット上限（ミリ秒）
+BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float("inf"))
+
+# Firestore の RPC を発生させるメソッドと、参照・クエリを組み立てるだけのメソッド
+FIRESTORE_RPC_METHODS = {"get", "set", "update", "delete", "stream", "commit", "get_all"}
+FIRESTORE_BUILDER_METHODS = {"collection", "document", "where", "limit", "select", "order_by",
+                             "start_after", "batch", "transaction"}
+
+enabled = False
+log_reruns = False
+
+_NULL_SPAN = contextlib.nullcontext()
+_lock = threading.Lock()
+_histograms = {}
+_local = threading.local()
+
+
+class Histogram:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS_MS)
+
+    def observe(self, ms):
+        self.count += 1
+        self.total += ms
+        self.min = min(self.min, ms)
+        self.max = max(self.max, ms)
+        for i, upper in enumerate(BUCKETS_MS):
+            if ms <= upper:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        # バケット内を線形補間した近似値（観測した最小値・最大値の範囲に収める）
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for upper, n in zip(BUCKETS_MS, self.buckets):
+            if n and seen + n >= rank:
+                lo, hi = max(lower, self.min), min(upper, self.max)
+                return lo + (hi - lo) * (rank - seen) / n
+            seen += n
+            lower = upper
+        return self.max
+
+
+def configure(enable, log_each_rerun=False):
+    global enabled, log_reruns
+    enabled = bool(enable)
+    log_reruns = bool(enable and log_each_rerun)
+
+
+def observe(name, ms):
+    with _lock:
+        hist = _histograms.get(name)
+        if hist is None:
+            hist = _histograms[name] = Histogram()
+        hist.observe(ms)
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans[name] = spans.get(name, 0.0) + ms
+
+
+@contextlib.contextmanager
+def _span(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, (time.perf_counter() - started) * 1000)
+
+
+def span(name):
+    return _span(name) if enabled else _NULL_SPAN
+
+
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            with _span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- 再実行単位 ---
+def begin_rerun():
+    if enabled:
+        _local.spans = {}
+        _local.started = time.perf_counter()
+
+
+def end_rerun(**fields):
+    spans = getattr(_local, "spans", None)
+    if not enabled or spans is None:
+        return
+    _local.spans = None
+    ms = (time.perf_counter() - _local.started) * 1000
+    observe("rerun", ms)
+    if log_reruns:
+        logger.info(json.dumps({"event": "rerun", "ms": round(ms, 2),
+                                "spans": {k: round(v, 2) for k, v in spans.items()}, **fields},
+                               ensure_ascii=False))
+
+
+# --- Firestore 呼び出しの計測 ---
+def _unwrap(value):
+    if isinstance(value, _TracedFirestore):
+        return value._target
+    if isinstance(value, list):
+        return [_unwrap(v) for v in value]
+    return value
+
+
+def _traced_stream(name, iterator):
+    started = time.perf_counter()
+    try:
+        yield from iterator
+    finally:
+        observe(name, (time.perf_counter() - started) * 1000)
+
+
+class _TracedFirestore:
+    """Firestore クライアント / 参照 / クエリ / バッチのラッパー。"""
+
+    __slots__ = ("_target",)
+
+    def __init__(self, target):
+        self._target = target
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if attr in FIRESTORE_BUILDER_METHODS:
+            @functools.wraps(value)
+            def build(*args, **kwargs):
+                return _TracedFirestore(value(*(_unwrap(a) for a in args), **kwargs))
+            return build
+        if attr in FIRESTORE_RPC_METHODS:
+            name = f"firestore.{attr}"
+            @functools.wraps(value)
+            def call(*args, **kwargs):
+                args = [_unwrap(a) for a in args]
+                if attr in ("stream", "get_all"):  # 実際の RPC はイテレーション中に走る
+                    return _traced_stream(name, value(*args, **kwargs))
+                with _span(name):
+                    return value(*args, **kwargs)
+            return call
+        return value
+
+
+_traced_client = None
+
+def instrument_firestore(db):
+    # 無効時は元のクライアントをそのまま返す。再実行ごとに同じラッパーを返す
+    global _traced_client
+    if not enabled:
+        return db
+    if _traced_client is None or _traced_client._target is not db:
+        _traced_client = _TracedFirestore(db)
+    return _traced_client
+
+
+# --- 出力 ---
+def snapshot():
+    with _lock:
+        items = sorted(_histograms.items())
+        return [{
+            "name": name,
+            "count": h.count,
+            "mean_ms": round(h.total / h.count, 2) if h.count else 0.0,
+            "p50_ms": round(h.quantile(0.5), 2),
+            "p95_ms": round(h.quantile(0.95), 2),
+            "max_ms": round(h.max, 2),
+            "total_ms": round(h.total, 2),
+        } for name, h in items]
+
+
+def metrics_text():
+    # Prometheus のテキスト形式に準じたダンプ
+    lines = ["# TYPE skillcheck_span_ms histogram"]
+    with _lock:
+        for name, h in sorted(_histograms.items()):
+            cumulative = 0
+            for upper, n in zip(BUCKETS_MS, h.buckets):
+                cumulative += n
+                le = "+Inf" if upper == float("inf") else str(upper)
+                lines.append(f'skillcheck_span_ms_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'skillcheck_span_ms_sum{{span="{name}"}} {h.total:.3f}')
+            lines.append(f'skillcheck_span_ms_count{{span="{name}"}} {h.count}')
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
@@ -0,0 +1,167 @@
+"""「次に学ぶ項目」のおすすめ。
+
+次に目指す認定レベル（TIER_RULES の基準を満たしていない最も低いレベル）の未達成項目を並べる。
+必須項目は認定に必ず要るので先に出し、同じ扱いの項目どうしは「回答が自分に近く、
+そのレベルで少し先を行く同僚」のうち達成している人の割合が高い順にする。
+
+同僚の検索には組織の回答行列（analytics.OrgMatrix）から作る PeerIndex を使う。
+全シートのビット列をつないだ行列を持っておき、全員とのハミング距離を
+XOR + popcount の1回のベクトル演算で求める。PeerIndex は行列（= カタログの版）ごとに
+プロセスで1つだけ作り、保存による行列の更新は REFRESH_INTERVAL ごとに取り込む。
+"""
+import math
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from analytics import TIER_RULES
+from catalog import LEVELS
+from scoring import POPCOUNT, popcount
+
+# 比べる同僚の人数
+NEIGHBOURS = 50
+# 表示する項目数
+RECOMMEND_LIMIT = 10
+# 必須項目の重み（同僚の達成率は 0〜1 なので、1 以上なら必須項目が常に先に並ぶ）
+REQUIRED_WEIGHT = 1.0
+# 行列が更新されていても PeerIndex を作り直さない期間（秒）
+REFRESH_INTERVAL = 30.0
+
+COLUMNS = ["シート", "NO", "スキルカテゴリ", "チェック項目", "必須", "同僚の達成率(%)"]
+
+
+class PeerIndex:
+    """全ユーザーの回答（全シートをつないだビット列）と、レベル別の達成件数。"""
+
+    def __init__(self, matrix):
+        self.matrix = matrix
+        self.catalog = matrix.catalog
+        self.index = matrix.index
+        with matrix._lock:
+            n = len(matrix.user_ids)
+            self.version = matrix.version
+            self.rows = dict(matrix._rows)
+            bits = [matrix._bits[name][:n] for name in self.index]
+            self.packed = np.hstack(bits) if bits else np.zeros((n, 0), dtype=np.uint8)
+        self.built_at = time.monotonic()
+
+        # シートごとのビット列の開始位置（バイト単位。シートの末尾は8ビット境界まで詰め物が入る）
+        widths = [si.cells.shape[-1] for si in self.index.values()]
+        self.offsets = np.concatenate([[0], np.cumsum(widths)]).astype(np.int64)
+
+        # masks[l] = レベル l の項目、required_masks[l] = レベル l の必須項目（つないだビット列上）
+        def level_masks(cells):
+            # (レベル, カテゴリ, バイト) のマスクをカテゴリ方向に OR し、シートをつなぐ
+            if not cells:
+                return np.zeros((len(LEVELS), 0), dtype=np.uint8)
+            return np.hstack([np.bitwise_or.reduce(c, axis=1) for c in cells])
+
+        self.masks = level_masks([si.cells for si in self.index.values()])
+        self.required_masks = level_masks([si.required_cells for si in self.index.values()])
+        self.total = popcount(self.masks)
+        self.required_total = popcount(self.required_masks)
+        # level_achieved[u, l] = ユーザー u のレベル l の達成件数
+        self.level_achieved = popcount(self.packed[:, None, :] & self.masks[None])
+
+    def pack(self, answers_by_sheet) -> np.ndarray:
+        # {sheet_name: 回答} → つないだビット列
+        parts = [si.pack(answers_by_sheet.get(name, {})) for name, si in self.index.items()]
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=np.uint8)
+
+    def neighbours(self, bits, level, exclude=None, k=NEIGHBOURS) -> np.ndarray:
+        # レベル level の達成件数が bits より多い人のうち、ハミング距離の近い k 人の行番号
+        li = LEVELS.index(level)
+        ahead = self.level_achieved[:, li] > int(popcount(bits & self.masks[li]))
+        if exclude is not None:
+            ahead[exclude] = False
+        candidates = np.flatnonzero(ahead)
+        if len(candidates) <= k:
+            return candidates
+        distance = POPCOUNT[self.packed[candidates] ^ bits].sum(axis=1, dtype=np.int64)
+        return candidates[np.argpartition(distance, k)[:k]]
+
+    def achieved_rates(self, rows) -> np.ndarray:
+        # つないだビット列の各ビットについて、rows の人のうち達成している割合
+        if len(rows) == 0:
+            return np.zeros(self.packed.shape[1] * 8)
+        return np.unpackbits(self.packed[rows], axis=1).mean(axis=0)
+
+
+class Recommendation:
+    """おすすめの結果。level が None なら全レベルの認定基準を満たしている。"""
+
+    __slots__ = ("level", "remaining", "remaining_required", "peer_count", "items")
+
+    def __init__(self, level, remaining, remaining_required, peer_count, items):
+        self.level = level
+        self.remaining = remaining  # 認定までに達成が必要な件数（必須の残りを含む）
+        self.remaining_required = remaining_required
+        self.peer_count = peer_count
+        self.items = items  # COLUMNS の DataFrame（おすすめ順）
+
+
+def next_tier(peers, bits):
+    # (目指すレベル, 認定までの残り件数, 必須の残り件数)。全レベル認定済みなら (None, 0, 0)
+    achieved = popcount(bits & peers.masks)
+    required_achieved = popcount(bits & peers.required_masks)
+    for level, threshold in TIER_RULES.items():
+        li = LEVELS.index(level)
+        total = int(peers.total[li])
+        if total == 0:
+            continue
+        remaining_required = int(peers.required_total[li] - required_achieved[li])
+        short = max(0, math.ceil(total * threshold / 100) - int(achieved[li]))
+        if short or remaining_required:
+            return level, max(short, remaining_required), remaining_required
+    return None, 0, 0
+
+
+def recommend(peers, answers_by_sheet, user_id=None, limit=RECOMMEND_LIMIT, k=NEIGHBOURS) -> Recommendation:
+    bits = peers.pack(answers_by_sheet)
+    level, remaining, remaining_required = next_tier(peers, bits)
+    if level is None:
+        return Recommendation(None, 0, 0, 0, pd.DataFrame(columns=COLUMNS))
+
+    li = LEVELS.index(level)
+    rows = peers.neighbours(bits, level, exclude=peers.rows.get(user_id), k=k)
+    rates = peers.achieved_rates(rows)
+
+    # 目指すレベルの未達成項目だけを、必須 → 同僚の達成率 → カタログ順 で並べる
+    candidates = np.flatnonzero(np.unpackbits(peers.masks[li] & ~bits))
+    required = np.unpackbits(peers.required_masks[li])[candidates].astype(bool)
+    score = required * REQUIRED_WEIGHT + rates[candidates]
+    top = candidates[np.lexsort((candidates, -score))[:limit]]
+
+    bit_offsets = peers.offsets * 8
+    sheet_pos = np.searchsorted(bit_offsets, top, side="right") - 1
+    names = list(peers.index)
+    records = []
+    for pos, s in zip(top.tolist(), sheet_pos.tolist()):
+        frame = peers.catalog.frame(names[s])
+        row = frame.iloc[pos - int(bit_offsets[s])]
+        records.append((names[s], row["NO"], row["スキルカテゴリ"], row["チェック項目"], bool(row["必須"]),
+                        round(float(rates[pos]) * 100, 1)))
+    return Recommendation(level, remaining, remaining_required, len(rows), pd.DataFrame(records, columns=COLUMNS))
+
+
+# --- プロセス共有の PeerIndex ---
+_lock = threading.Lock()
+_peers = None
+
+def _fresh(peers, matrix):
+    return peers is not None and peers.matrix is matrix and (
+        peers.version == matrix.version or time.monotonic() - peers.built_at < REFRESH_INTERVAL)
+
+
+def get_peer_index(matrix) -> PeerIndex:
+    global _peers
+    peers = _peers
+    if _fresh(peers, matrix):
+        return peers
+    with _lock:
+        peers = _peers
+        if not _fresh(peers, matrix):
+            peers = _peers = PeerIndex(matrix)
+    return peers
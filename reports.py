@@ -0,0 +1,206 @@
+"""社員別スキルレポート（PDF）の一括作成（コマンドライン）。
+
+使い方:
+    python reports.py reports.zip                           # 全ユーザー
+    python reports.py reports.zip --department 営業部
+    python reports.py reports.zip --users u001,u002 [--workers 4]
+
+1人1ページの PDF（分析画面と同じ全体ドーナツ・シート別レーダー・スキルレベル別の集計表）を作り、
+ZIP に {user_id}.pdf として書き出す。描画はプロセスプールで並列に行い、各ワーカーは起動時に1回だけ
+カタログの読み込みとフォント（IPAex）の登録をする。回答は USERS_PER_FETCH 人分ずつまとめて取得し、
+処理中のタスクはワーカー数の2倍までに抑えるので、人数によらずメモリ使用量は一定になる。
+
+接続先の指定は bulk_tool.py と同じ（--sqlite / --credentials / .streamlit/secrets.toml）。
+"""
+import argparse
+import io
+import multiprocessing
+import os
+import re
+import sys
+import time
+import zipfile
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import date
+from itertools import islice
+
+import storage
+from bulk_tool import connect
+from catalog import LEVELS
+from catalog_registry import CATALOG_DIR, get_registry
+from resources import configure_fonts
+from scoring import ALL, evaluate
+
+# 1回の get_answers で取得する人数と、1タスク（ワーカーへの1回の受け渡し）の人数
+USERS_PER_FETCH = 500
+USERS_PER_TASK = 25
+PAGE_SIZE = (8.27, 11.69)  # A4 縦（インチ）
+SOURCE_NOTE = "出典：情報処理推進機構(IPA)「データサイエンティスト スキルチェックシート Ver5.00」"
+
+_UNSAFE_CHARS = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+
+
+def report_filename(user_id) -> str:
+    return f"{_UNSAFE_CHARS.sub('_', user_id)}.pdf"
+
+
+# --- 1人分の描画 ---
+def summary_rows(achievement):
+    # スキルレベル別の [レベル, 達成/合計, 必須(達成/合計), 点数] と合計点数（必須は+1点ボーナス）
+    rows = []
+    total_score = total_max_score = 0
+    for level in LEVELS:
+        s = achievement.level_scores(level)
+        if s["total"] > 0:
+            rows.append([level, f"{s['achieved']} / {s['total']}",
+                         f"{s['required_achieved']} / {s['required_total']}", f"{s['score']} / {s['max_score']}"])
+            total_score += s["score"]
+            total_max_score += s["max_score"]
+    return rows, total_score, total_max_score
+
+
+def render_report(catalog_version, user_id, department, docs, created) -> bytes:
+    # docs: { sheet: skill_answers ドキュメント }（未回答のシートはなくてよい）
+    from matplotlib.figure import Figure
+
+    from charts import draw_donut, draw_radar
+
+    catalog = catalog_version.catalog
+    achievement = evaluate(catalog, {
+        sheet: storage.doc_answers(docs.get(sheet) or {"user_id": user_id, "sheet": sheet}, catalog_version)
+        for sheet in catalog.sheet_names
+    })
+
+    fig = Figure(figsize=PAGE_SIZE)
+    fig.text(0.5, 0.95, "スキルチェック レポート", ha="center", fontsize=18, fontweight="bold")
+    fig.text(0.08, 0.915, f"ユーザーID: {user_id}　　部署: {department or '-'}　　"
+                          f"作成日: {created}　　チェックシート: Ver{catalog_version.version}", fontsize=9)
+
+    achieved_count, total_count, _, _ = achievement.counts(level=ALL)
+    ax = fig.add_axes([0.04, 0.55, 0.42, 0.31])
+    draw_donut(ax, achieved_count, total_count, "進捗度", fontsize=14)
+    ax.set_title(f"スキル達成度（{ALL}）", fontsize=11)
+    fig.text(0.25, 0.53, f"未達成の必須項目数: {achievement.remaining_required(ALL)} 件", ha="center", fontsize=10)
+
+    ax = fig.add_axes([0.6, 0.58, 0.28, 0.23], projection="polar")
+    draw_radar(ax, {sheet: achievement.rate(sheet, ALL) for sheet in catalog.sheet_names},
+               f"全体スキル達成度（{ALL})")
+    ax.tick_params(labelsize=8)
+
+    rows, total_score, total_max_score = summary_rows(achievement)
+    fig.text(0.08, 0.46, "スキルレベル別 達成状況", fontsize=12, fontweight="bold")
+    if rows:
+        ax = fig.add_axes([0.08, 0.30, 0.84, 0.15])
+        ax.axis("off")
+        table = ax.table(cellText=rows, colLabels=["スキルレベル", "達成/合計", "必須(達成/合計)", "点数"],
+                         loc="upper center", cellLoc="center")
+        table.scale(1, 1.6)
+        fig.text(0.08, 0.33, f"合計点数: {total_score} / {total_max_score}", fontsize=12, fontweight="bold")
+    else:
+        fig.text(0.08, 0.42, "表示できるデータがありません。", fontsize=10)
+    fig.text(0.5, 0.03, SOURCE_NOTE, ha="center", fontsize=7, color="gray")
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format="pdf")
+    fig.clear()
+    return buf.getvalue()
+
+
+# --- ワーカー（プロセスごとに1回だけ初期化する） ---
+_catalog_version = None
+
+
+def _init_worker(catalog_dir):
+    # カタログ（回答の読み替えに使う版）とフォントを読み込んでおく
+    global _catalog_version
+    _catalog_version = get_registry(catalog_dir, watch_interval=0).active
+    configure_fonts()
+
+
+def _render_task(task, created):
+    # task: [(user_id, department, docs)] → [(ファイル名, PDF)]
+    return [(report_filename(user_id), render_report(_catalog_version, user_id, department, docs, created))
+            for user_id, department, docs in task]
+
+
+# --- 対象ユーザーと回答の取得 ---
+def select_users(db, user_ids=None, department=None):
+    # [(user_id, department)] を順に返す（ID 指定がなければ users を1ページずつ読む）
+    if user_ids:
+        for user_id in user_ids:
+            profile = db.get_user(user_id)
+            if profile is None:
+                print(f"  スキップ: ユーザー {user_id!r} はいません", file=sys.stderr)
+                continue
+            yield user_id, profile.get("department", "")
+        return
+    for user_id, data in db.iter_users(fields=["department"]):
+        if department is None or data.get("department", "") == department:
+            yield user_id, data.get("department", "")
+
+
+def iter_tasks(db, users, sheets, users_per_fetch=USERS_PER_FETCH, users_per_task=USERS_PER_TASK):
+    # 回答は users_per_fetch 人分を1回の呼び出しでまとめて取得し、users_per_task 人ずつに分ける
+    users = iter(users)
+    while block := list(islice(users, users_per_fetch)):
+        docs = db.get_answers([(user_id, sheet) for user_id, _ in block for sheet in sheets])
+        task = [(user_id, department, {sheet: docs[user_id, sheet] for sheet in sheets if (user_id, sheet) in docs})
+                for user_id, department in block]
+        for start in range(0, len(task), users_per_task):
+            yield task[start:start + users_per_task]
+
+
+def run_reports(db, path, users, workers=None, catalog_dir=CATALOG_DIR):
+    started = time.monotonic()
+    workers = workers or os.cpu_count() or 1
+    sheets = get_registry(catalog_dir, watch_interval=0).active.catalog.sheet_names
+    created = date.today().isoformat()
+    written = 0
+    pending = set()
+
+    # Firestore クライアント（gRPC）は fork と相性が悪いので、ワーカーは spawn で起動する
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=_init_worker, initargs=(catalog_dir,))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf, pool:
+        def collect(return_when):
+            # 終わったタスクの PDF を ZIP に書き出す（ZIP への書き込みはこのプロセスだけで行う）
+            nonlocal written
+            done, _ = wait(pending, return_when=return_when)
+            for future in done:
+                pending.discard(future)
+                for name, pdf in future.result():
+                    zf.writestr(name, pdf)
+                    written += 1
+            print(f"  {written} 件 ({time.monotonic() - started:.1f}s)", file=sys.stderr)
+
+        for task in iter_tasks(db, users, sheets):
+            if len(pending) >= workers * 2:
+                collect(FIRST_COMPLETED)
+            pending.add(pool.submit(_render_task, task, created))
+        while pending:
+            collect(ALL_COMPLETED)
+
+    print(f"レポート: {written} 件 → {path} ({time.monotonic() - started:.1f}s)", file=sys.stderr)
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="社員別スキルレポート（PDF）を一括作成して ZIP に書き出す")
+    parser.add_argument("path", help="出力する ZIP ファイル")
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument("--users", help="対象のユーザーID（カンマ区切り）")
+    target.add_argument("--department", help="対象の部署（省略時は全ユーザー）")
+    parser.add_argument("--workers", type=int, help="描画プロセス数（省略時は CPU 数）")
+    parser.add_argument("--catalog-dir", default=CATALOG_DIR, help="skillcheck_ver*.xlsx のあるディレクトリ")
+    parser.add_argument("--credentials", help="サービスアカウント JSON（省略時は .streamlit/secrets.toml）")
+    parser.add_argument("--sqlite", help="Firestore の代わりに使う SQLite ファイル")
+
+    args = parser.parse_args(argv)
+    db = connect(args)
+    user_ids = [u.strip() for u in args.users.split(",") if u.strip()] if args.users else None
+    run_reports(db, args.path, select_users(db, user_ids, args.department),
+                workers=args.workers, catalog_dir=args.catalog_dir)
+
+
+if __name__ == "__main__":
+    main()
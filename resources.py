@@ -0,0 +1,134 @@
+"""プロセス共有のリソース（ストレージバックエンド・フォント）と起動時のウォームアップ。
+
+どれもプロセス内で一度だけ作り、全セッション・全再実行で使い回す。
+重いライブラリ（firebase_admin, matplotlib, plotly）は初めて必要になったときに import する。
+"""
+import logging
+import os
+import threading
+import tomllib
+
+logger = logging.getLogger(__name__)
+
+SECRETS_PATH = os.path.join(".streamlit", "secrets.toml")
+FONT_PATH = os.path.join("fonts", "ipaexg.ttf")
+SQLITE_PATH = "skillcheck.db"
+
+_lock = threading.RLock()
+_db = None
+_backend = None
+_font_name = None
+_warm_up_thread = None
+
+
+def read_secrets(path=SECRETS_PATH) -> dict:
+    # Streamlit の外（CLI・ランチャー）から secrets.toml を読む
+    with open(path, "rb") as f:
+        return tomllib.load(f)
+
+
+# ---- DB接続 ----
+def get_firestore(firebase_config=None):
+    # firebase_config: 認証情報の dict またはサービスアカウント JSON のパス（省略時は secrets.toml）
+    global _db
+    if _db is None:
+        with _lock:
+            if _db is None:
+                import firebase_admin
+                from firebase_admin import credentials, firestore
+
+                if not firebase_admin._apps:  # 既存アプリがなければ初期化
+                    if firebase_config is None:
+                        firebase_config = dict(read_secrets()["firebase"])
+                    firebase_admin.initialize_app(credentials.Certificate(firebase_config))
+                _db = firestore.client()
+    return _db
+
+
+def get_backend(settings=None):
+    # settings: secrets と同じ形の設定（省略時は secrets.toml）
+    #   storage_backend = "firestore"（既定）| "sqlite"、sqlite_path、[firebase]
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                import metrics
+                from backends import FirestoreBackend, SQLiteBackend
+
+                if settings is None:
+                    settings = read_secrets()
+                if settings.get("storage_backend", "firestore") == "sqlite":
+                    _backend = SQLiteBackend(settings.get("sqlite_path", SQLITE_PATH))
+                else:
+                    client = get_firestore(dict(settings["firebase"]))
+                    _backend = FirestoreBackend(metrics.instrument_firestore(client))
+    return _backend
+
+
+# --- フォント設定（ローカルフォント読み込み） ---
+def configure_fonts(font_path=FONT_PATH) -> str:
+    global _font_name
+    if _font_name is None:
+        with _lock:
+            if _font_name is None:
+                import matplotlib
+                from matplotlib import font_manager as fm
+
+                # 名前で引けるよう fontManager に登録してから既定フォントにする
+                fm.fontManager.addfont(font_path)
+                name = fm.FontProperties(fname=font_path).get_name()
+                matplotlib.rcParams["font.family"] = name
+                matplotlib.rcParams["axes.unicode_minus"] = False
+                _font_name = name
+    return _font_name
+
+
+# --- ウォームアップ ---
+def warm_up(settings=None, catalog_dir=None, plotting=True, peers=True):
+    # 最初のユーザーが待たされないよう、共有リソースを先に作っておく
+    # （catalog_dir はアプリと同じ値を渡す。省略時は secrets の catalog_dir）
+    import metrics
+    from catalog_registry import CATALOG_DIR, get_registry
+
+    if settings is None:
+        settings = read_secrets()
+    if catalog_dir is None:
+        catalog_dir = settings.get("catalog_dir", CATALOG_DIR)
+    catalog_version = get_registry(catalog_dir).active  # 索引もここで作られる
+    catalog = catalog_version.catalog
+    if plotting:
+        import charts
+
+        configure_fonts()
+        charts.donut_chart_image(0, 1, "進捗度")
+        charts.radar_chart_spec({sheet: 0 for sheet in catalog.sheet_names}, "")
+    # バックエンドはプロセスで1回だけ作るので、計測の有無はアプリ（app.py）と同じ設定で先に決めておく
+    metrics.configure(settings.get("metrics_enabled", False), settings.get("metrics_log_reruns", False))
+    backend = get_backend(settings)
+    if peers:
+        # おすすめ項目は全員の回答行列を使うので、最初の分析画面の前に作っておく。
+        # 行列は analytics のバックグラウンド構築に任せ（失敗してもログに残るだけ）、できたら索引を作る
+        from analytics import latest_org_matrix, refresh_async
+        from recommend import get_peer_index
+
+        refresh_async(backend, catalog_version).join()
+        matrix = latest_org_matrix(backend, catalog_version)
+        if matrix is not None:
+            get_peer_index(matrix)
+
+
+def _warm_up_safely(**kwargs):
+    try:
+        warm_up(**kwargs)
+    except Exception:
+        logger.exception("warm-up failed")
+
+
+def warm_up_async(**kwargs):
+    # プロセスで1回だけ、バックグラウンドで warm_up を実行する
+    global _warm_up_thread
+    with _lock:
+        if _warm_up_thread is None:
+            _warm_up_thread = threading.Thread(target=_warm_up_safely, kwargs=kwargs, daemon=True)
+            _warm_up_thread.start()
+    return _warm_up_thread
@@ -0,0 +1,229 @@
+"""ビットセットによる達成度集計エンジン。
+
+シートごとに「レベル × スキルカテゴリ（× 必須）」のマスクを packbits で
+事前計算しておき、ユーザーの回答を1シート1本のビット列に変換して
+AND + popcount だけで全ビュー分の件数をまとめて求める。
+保存済みの回答（SheetAnswers）は同じビット列をそのまま持つので、集計時に項目ごとの変換はしない。
+"""
+import threading
+from collections.abc import Mapping
+
+import numpy as np
+
+from catalog import LEVELS
+
+# 1バイトごとの立っているビット数
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+ALL = "ALL"
+
+
+def popcount(bits) -> np.ndarray:
+    # 最終軸方向のビット数（多次元のマスク群にもそのまま適用できる）
+    return POPCOUNT[bits].sum(axis=-1, dtype=np.int64)
+
+
+class SheetIndex:
+    """1シート分の事前計算済みマスク。"""
+
+    def __init__(self, sheet_catalog):
+        sc = sheet_catalog
+        strings = sc.strings
+        self.name = sc.name
+        self.keys = [str(no) for no in sc.no.tolist()]
+        self.size = len(self.keys)
+        self.position = {key: i for i, key in enumerate(self.keys)}
+
+        category_names = strings[sc.category]
+        level_names = strings[sc.level]
+        self.categories = sorted(set(category_names.tolist()) - {""})
+
+        level_masks = np.stack([level_names == level for level in LEVELS])
+        category_masks = np.stack([category_names == cat for cat in self.categories]) \
+            if self.categories else np.zeros((0, self.size), dtype=bool)
+
+        # cells[l, c] = レベル l かつ カテゴリ c の項目
+        cells = level_masks[:, None, :] & category_masks[None, :, :]
+        self.cells = np.packbits(cells, axis=-1)
+        self.required_cells = np.packbits(cells & sc.required, axis=-1)
+        self.total = popcount(self.cells)
+        self.required_total = popcount(self.required_cells)
+
+    def pack(self, answers) -> np.ndarray:
+        # {str(NO): bool} → カタログ順のビット列
+        if isinstance(answers, SheetAnswers) and answers.index is self:
+            return answers.bits
+        get = answers.get
+        achieved = np.fromiter((bool(get(k, False)) for k in self.keys), dtype=bool, count=self.size)
+        return np.packbits(achieved)
+
+    def unpack(self, bits) -> dict:
+        # ビット列 → {str(NO): bool}（別の版の回答を読み替えるとき用）
+        achieved = np.unpackbits(np.frombuffer(bits, dtype=np.uint8), count=self.size).astype(bool)
+        return dict(zip(self.keys, achieved.tolist()))
+
+    def evaluate(self, bits) -> "SheetAchievement":
+        return SheetAchievement(
+            self.name,
+            self.categories,
+            popcount(self.cells & bits),
+            self.total,
+            popcount(self.required_cells & bits),
+            self.required_total,
+        )
+
+
+class SheetAnswers(Mapping):
+    """1シート分の回答（カタログ順のパック済みビット列）。{str(NO): bool} としても読める。
+
+    ビット列は共有されるので変更しないこと（更新は updated() で新しいインスタンスを作る）。
+    """
+
+    __slots__ = ("index", "bits")
+
+    def __init__(self, index, bits):
+        self.index = index
+        self.bits = bits
+
+    @classmethod
+    def from_bytes(cls, index, data):
+        bits = np.frombuffer(data, dtype=np.uint8)
+        if len(bits) != (index.size + 7) // 8:
+            raise ValueError(f"bit length mismatch for sheet {index.name}: {len(bits)}")
+        return cls(index, bits)
+
+    @classmethod
+    def from_dict(cls, index, answers):
+        return cls(index, index.pack(answers))
+
+    @classmethod
+    def empty(cls, index):
+        return cls(index, np.zeros((index.size + 7) // 8, dtype=np.uint8))
+
+    def __getitem__(self, no):
+        i = self.index.position[no]
+        return bool((self.bits[i >> 3] >> (7 - (i & 7))) & 1)
+
+    def __iter__(self):
+        return iter(self.index.keys)
+
+    def __len__(self):
+        return self.index.size
+
+    def to_array(self) -> np.ndarray:
+        return np.unpackbits(self.bits, count=self.index.size).astype(bool)
+
+    def lookup(self, nos) -> np.ndarray:
+        # str(NO) の列 → 達成フラグの配列（カタログにない NO は False）
+        positions = np.fromiter((self.index.position.get(no, -1) for no in nos), dtype=np.int64)
+        return np.where(positions >= 0, self.to_array()[positions], False)
+
+    def achieved_keys(self) -> list:
+        keys = self.index.keys
+        return [keys[i] for i in np.flatnonzero(self.to_array())]
+
+    def updated(self, changes) -> "SheetAnswers":
+        achieved = self.to_array()
+        for no, value in changes.items():
+            i = self.index.position.get(no)
+            if i is not None:
+                achieved[i] = bool(value)
+        return SheetAnswers(self.index, np.packbits(achieved))
+
+    def to_bytes(self) -> bytes:
+        return self.bits.tobytes()
+
+
+class SheetAchievement:
+    """1シート分の集計結果。各配列の形は (レベル, カテゴリ)。"""
+
+    def __init__(self, name, categories, achieved, total, required_achieved, required_total):
+        self.name = name
+        self.categories = categories
+        self.achieved = achieved
+        self.total = total
+        self.required_achieved = required_achieved
+        self.required_total = required_total
+
+    def _levels(self, array, level):
+        if level == ALL:
+            return array.sum(axis=0)
+        return array[LEVELS.index(level)]
+
+    def counts(self, level=ALL):
+        # (達成件数, 合計件数, 必須達成件数, 必須合計件数)
+        return (
+            int(self._levels(self.achieved, level).sum()),
+            int(self._levels(self.total, level).sum()),
+            int(self._levels(self.required_achieved, level).sum()),
+            int(self._levels(self.required_total, level).sum()),
+        )
+
+    def category_counts(self, level=ALL):
+        # [(カテゴリ, 達成件数, 合計件数)]（対象項目のないカテゴリは除く）
+        achieved = self._levels(self.achieved, level)
+        total = self._levels(self.total, level)
+        return [(cat, int(a), int(t)) for cat, a, t in zip(self.categories, achieved, total) if t > 0]
+
+
+class Achievement:
+    """全シートの集計結果。ドーナツ・レーダー・集計表はすべてここから描画する。"""
+
+    def __init__(self, sheets):
+        self.sheets = sheets  # {sheet_name: SheetAchievement}
+
+    def counts(self, sheet=None, level=ALL):
+        targets = [self.sheets[sheet]] if sheet is not None else self.sheets.values()
+        totals = [0, 0, 0, 0]
+        for sa in targets:
+            for i, v in enumerate(sa.counts(level)):
+                totals[i] += v
+        return tuple(totals)
+
+    def rate(self, sheet=None, level=ALL) -> float:
+        achieved, total, _, _ = self.counts(sheet, level)
+        return (achieved / total) * 100 if total > 0 else 0
+
+    def remaining_required(self, level=ALL) -> int:
+        _, _, required_achieved, required_total = self.counts(level=level)
+        return required_total - required_achieved
+
+    def category_rates(self, sheet, level=ALL):
+        return {cat: (a / t) * 100 for cat, a, t in self.sheets[sheet].category_counts(level)}
+
+    def level_scores(self, level):
+        # スコア計算（必須は+1点ボーナス）
+        achieved, total, required_achieved, required_total = self.counts(level=level)
+        return {
+            "achieved": achieved,
+            "total": total,
+            "required_achieved": required_achieved,
+            "required_total": required_total,
+            "score": achieved + required_achieved,
+            "max_score": total + required_total,
+        }
+
+
+# --- カタログごとのインデックス（プロセス共有） ---
+_lock = threading.Lock()
+_indexes = {}
+
+def get_index(catalog):
+    key = (catalog.digest, tuple(catalog.sheet_names))
+    index = _indexes.get(key)
+    if index is None:
+        with _lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = {name: SheetIndex(sc) for name, sc in catalog.sheets.items()}
+                _indexes[key] = index
+    return index
+
+
+def evaluate(catalog, answers_by_sheet) -> Achievement:
+    # answers_by_sheet: {sheet_name: SheetAnswers または {str(NO): bool}}
+    index = get_index(catalog)
+    return Achievement({
+        name: si.evaluate(si.pack(answers_by_sheet.get(name, {})))
+        for name, si in index.items()
+    })
@@ -0,0 +1,22 @@
+"""本番用の起動スクリプト（`streamlit run app.py` の代わり）。
+
+    python serve.py [--server.port 8501 ...]
+
+Streamlit サーバーと同じプロセスでウォームアップ（カタログ・Firestore クライアント・
+フォント・グラフライブラリ）を先に始めるので、最初にアクセスしたユーザーが待たされない。
+"""
+import sys
+
+from resources import warm_up_async
+
+
+def main():
+    warm_up_async()
+    from streamlit.web import cli as stcli
+
+    sys.argv = ["streamlit", "run", "app.py", *sys.argv[1:]]
+    sys.exit(stcli.main())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,381 @@
+"""users / sessions / skill_answers のアクセスとプロセス共有キャッシュ。
+
+読み書きは backends.py のバックエンド（Firestore / SQLite）を通す。引数の db はバックエンド。
+skill_answers はユーザー単位で全シート分を1回の呼び出しでまとめて取得し、
+TTL・件数上限つきの LRU キャッシュに載せて全セッションで共有する。
+保存はキャッシュとの差分（変更された項目）だけを、保存済みの最新の回答に重ねてトランザクションで
+書き込み（キャッシュは書き込みの成功後に更新する）、必要なら write-behind キューで連続保存をまとめる。
+
+回答ドキュメントには保存時のカタログの版（catalog_version）を付け、古い版の回答は
+読み込み時にその版の NO へ読み替える。版は呼び出し側が再実行の最初に取得した
+catalog_registry.CatalogVersion を引数で渡す（キャッシュも版ごとに持つ）。
+
+sessions はトークンのハッシュをキーにして直接取得して検証し、
+検証済みトークンは有効期限つきでプロセス内にキャッシュする。
+"""
+import atexit
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+from backends import FIRESTORE_BATCH_LIMIT
+from scoring import SheetAnswers
+
+logger = logging.getLogger(__name__)
+
+# セッションの有効期限（created_at 起点）
+SESSION_TTL = timedelta(days=7)
+# 期限切れセッションの一括削除の実行間隔（プロセスごと）
+SESSION_CLEANUP_INTERVAL = 3600.0
+
+
+class TTLCache:
+    """スレッドセーフな LRU キャッシュ（件数上限 + 有効期限）。"""
+
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# { user_id: (CatalogVersion, { sheet: SheetAnswers }) }（版の指定がなければ { str(NO): bool }）
+# キャッシュした値は全セッションで共有するため、呼び出し側で変更しないこと
+answers_cache = TTLCache(maxsize=2048, ttl=300.0)
+
+
+def doc_answers(data, catalog_version=None, strict=False):
+    # skill_answers ドキュメント → catalog_version の版の回答（旧形式のマップ・古い版のビット列も読める）。
+    # strict なら読めない回答を空にせず catalog_registry.UnknownCatalogVersion にする（上書き前の読み込み用）
+    if catalog_version is None:
+        return data.get("answers", {})
+    return catalog_version.decode_answers(data, strict)
+
+
+def answers_document(user_id, sheet, answers, catalog_version=None):
+    # 書き込むドキュメントと merge の要否。SheetAnswers はビット列で全体を置き換える
+    # （旧形式の answers マップも消える）。dict は変更分だけを項目単位で merge する
+    data = {
+        "user_id": user_id,
+        "sheet": sheet,
+        "updated_at": datetime.now()
+    }
+    if catalog_version is not None:
+        data["catalog_version"] = catalog_version.version
+    if isinstance(answers, SheetAnswers):
+        data["bits"] = answers.to_bytes()  # カタログ順のパック済みビット列
+        return data, False
+    data["answers"] = answers  # { no: achieved }（変更分のみ）
+    return data, True
+
+
+# ---- 一括取得（全シートを1回の呼び出しで） ----
+def _cached_answers(user_id, catalog_version):
+    # 同じ版で読み込んだキャッシュだけを使う
+    entry = answers_cache.get(user_id)
+    if entry is None or entry[0] is not catalog_version:
+        return None
+    return entry[1]
+
+
+def fetch_user_answers(db, user_id, sheets, catalog_version=None) -> dict:
+    cached = _cached_answers(user_id, catalog_version)
+    if cached is not None and all(sheet in cached for sheet in sheets):
+        return cached
+
+    docs = db.get_answers([(user_id, sheet) for sheet in sheets])
+    result = {sheet: doc_answers(docs.get((user_id, sheet)) or {"user_id": user_id, "sheet": sheet},
+                                 catalog_version)
+              for sheet in sheets}
+
+    if cached is not None:
+        result = {**cached, **result}
+    answers_cache.set(user_id, (catalog_version, result))
+    return result
+
+
+# ---- 保存処理（キャッシュはライトスルー） ----
+# 保存後に (db, user_id, sheet, 保存後の回答, 変更された項目, 版) で呼ばれるフック（集計の差分更新・履歴用）
+save_listeners = []
+
+
+def diff_answers(current, answers_dict) -> dict:
+    # 未回答は未達成（False）とみなし、値が変わった項目だけを返す
+    return {no: achieved for no, achieved in answers_dict.items() if current.get(no, False) != achieved}
+
+
+def _updated(answers, changes):
+    # 共有中の値は書き換えず、変更を重ねた新しい値を返す
+    if isinstance(answers, SheetAnswers):
+        return answers.updated(changes)
+    return {**answers, **changes}
+
+
+def _remember(user_id, sheet, answers, catalog_version):
+    cached = _cached_answers(user_id, catalog_version) or {}
+    answers_cache.set(user_id, (catalog_version, {**cached, sheet: answers}))
+
+
+def commit_changes(db, items, catalog_version=None, remember=True) -> dict:
+    # items: [(user_id, sheet, { no: achieved })]。キャッシュではなく保存済みの最新の回答に変更を重ね、
+    # FIRESTORE_BATCH_LIMIT 件ずつ1トランザクションで書き込む（他のプロセス・セッションの保存を消さない）。
+    # 書き込めたものから、実際に値が変わった項目で保存フックを呼ぶ。戻り値は { (user_id, sheet): 保存後の回答 }
+    saved = {}
+    for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+        chunk = {(user_id, sheet): changes for user_id, sheet, changes in items[start:start + FIRESTORE_BATCH_LIMIT]}
+        results = {}
+
+        def update(user_id, sheet, data):
+            # 競合して再実行されたときは results を上書きする（最後に実行した結果がコミットされる）
+            # 読めない回答を空として上書きしないよう strict で読む（UnknownCatalogVersion で保存を中止する）
+            stored = doc_answers(data or {"user_id": user_id, "sheet": sheet}, catalog_version, strict=True)
+            changes = chunk[user_id, sheet]
+            merged = _updated(stored, changes)
+            results[user_id, sheet] = merged, diff_answers(stored, changes)
+            # ビット列は数十バイトなので毎回全体を書く（旧形式のマップは変更分だけを merge する）
+            return answers_document(user_id, sheet, merged if isinstance(merged, SheetAnswers) else changes,
+                                    catalog_version)
+
+        db.update_answers(list(chunk), update)
+        for (user_id, sheet), (merged, flipped) in results.items():
+            saved[user_id, sheet] = merged
+            if remember:
+                _remember(user_id, sheet, merged, catalog_version)
+            if flipped:
+                for listener in save_listeners:
+                    listener(db, user_id, sheet, merged, flipped, catalog_version)
+    return saved
+
+
+def save_user_answers(db, user_id, sheet, answers_dict, catalog_version=None) -> int:
+    # 戻り値は変更した（書き込んだ、または書き込み待ちにした）項目数
+    current = fetch_user_answers(db, user_id, [sheet], catalog_version)[sheet]
+    changes = diff_answers(current, answers_dict)
+    if not changes:
+        return 0
+
+    if write_behind is not None:
+        write_behind.enqueue(user_id, sheet, changes, catalog_version)
+        # 書き込み待ちの間も自分の変更が見えるよう、キャッシュには先に重ねておく
+        _remember(user_id, sheet, _updated(current, changes), catalog_version)
+        return len(changes)
+    try:
+        # キャッシュと保存フックは書き込みが済んでから更新する（失敗時に再保存の差分が空にならないように）
+        commit_changes(db, [(user_id, sheet, changes)], catalog_version)
+    except Exception:
+        # 書き込めたか分からないので、次の保存・表示は DB から読み直す
+        answers_cache.pop(user_id)
+        raise
+    return len(changes)
+
+
+class WriteBehindQueue:
+    """短時間に続く保存の変更をまとめて、少ない回数のトランザクションで書き込むキュー。"""
+
+    def __init__(self, db, delay=2.0):
+        self.db = db
+        self.delay = delay
+        self._pending = {}  # (user_id, sheet, 版) -> { no: achieved }（変更された項目）
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def _schedule(self):
+        # _lock を持って呼ぶ
+        if self._timer is None:
+            self._timer = threading.Timer(self.delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def enqueue(self, user_id, sheet, changes, catalog_version=None):
+        key = (user_id, sheet, catalog_version)
+        with self._lock:
+            self._pending[key] = {**self._pending.get(key, {}), **changes}
+            self._schedule()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+        by_version = {}
+        for (user_id, sheet, catalog_version), changes in pending.items():
+            by_version.setdefault(catalog_version, []).append((user_id, sheet, changes))
+        for catalog_version, items in by_version.items():
+            self._commit(items, catalog_version)
+
+    def _commit(self, items, catalog_version):
+        try:
+            # キャッシュには enqueue 時に重ねてあり、後から来た書き込み待ちの変更も含むので触らない
+            commit_changes(self.db, items, catalog_version, remember=False)
+        except LookupError:
+            # 保存済みの回答が読めない（catalog_registry.UnknownCatalogVersion）ドキュメントは上書きせずに変更を捨てる。
+            # 同じ回にまとめたほかのドキュメントは1件ずつ書き直す（項目単位の上書きなので書き込み済みでもよい）
+            if len(items) > 1:
+                for item in items:
+                    self._commit([item], catalog_version)
+            else:
+                logger.error("dropping unsaved changes of %s/%s: the stored answers cannot be decoded",
+                             items[0][0], items[0][1])
+        except Exception:
+            # 変更は項目単位の上書きなので、一部が書き込み済みでも全件を再投入してよい
+            logger.exception("write-behind commit failed; re-queueing %d documents", len(items))
+            with self._lock:
+                for user_id, sheet, changes in items:
+                    key = (user_id, sheet, catalog_version)
+                    # 失敗中に来た新しい変更を優先する
+                    self._pending[key] = {**changes, **self._pending.get(key, {})}
+                self._schedule()
+
+
+write_behind = None
+
+def enable_write_behind(db, delay):
+    # delay <= 0 で無効（保存のたびに直接書き込む）
+    global write_behind
+    if delay <= 0:
+        if write_behind is not None:
+            write_behind.flush()
+        write_behind = None
+    elif write_behind is None or write_behind.db is not db:
+        if write_behind is not None:
+            write_behind.flush()
+        write_behind = WriteBehindQueue(db, delay)
+        atexit.register(write_behind.flush)
+    else:
+        write_behind.delay = delay
+
+
+# ---- ユーザー情報（パスワード以外、キャッシュ付き） ----
+profile_cache = TTLCache(maxsize=4096, ttl=600.0)
+
+
+def remember_user_profile(user_id, data):
+    profile_cache.set(user_id, {k: v for k, v in data.items() if k != "password"})
+
+
+def fetch_user_profile(db, user_id) -> dict:
+    profile = profile_cache.get(user_id)
+    if profile is None:
+        remember_user_profile(user_id, db.get_user(user_id) or {})
+        profile = profile_cache.get(user_id)
+    return profile
+
+
+# ---- セッション（トークン）管理 ----
+# { session_key: user_id }（エントリの TTL はセッションの残り有効期間以下）
+session_cache = TTLCache(maxsize=4096, ttl=600.0)
+
+
+def session_key(token) -> str:
+    # トークンそのものではなくハッシュをキー（Firestore ではドキュメントID）にする
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def _session_expires_at(created_at) -> datetime:
+    if created_at.tzinfo is None:  # 旧形式（naive）は UTC として扱う
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at + SESSION_TTL
+
+
+def _remember_session(key, user_id, created_at):
+    remaining = (_session_expires_at(created_at) - datetime.now(timezone.utc)).total_seconds()
+    if remaining > 0:
+        session_cache.set(key, user_id, ttl=min(remaining, session_cache.ttl))
+
+
+def create_session(db, user_id) -> str:
+    token = secrets.token_hex(16)
+    key = session_key(token)
+    created_at = datetime.now(timezone.utc)
+    db.set_session(key, {
+        "user_id": user_id,
+        "created_at": created_at
+    })
+    _remember_session(key, user_id, created_at)
+    maybe_cleanup_expired_sessions(db)
+    return token
+
+
+def validate_session(db, token):
+    # 有効なら user_id、無効・期限切れなら None
+    key = session_key(token)
+    user_id = session_cache.get(key)
+    if user_id is not None:
+        return user_id
+
+    data = db.get_session(key)
+    if data is None:
+        # 旧形式（ドキュメントID = user_id, token フィールド）からの移行
+        data = db.pop_legacy_session(token)
+        if data is None:
+            return None
+        if _session_expires_at(data["created_at"]) > datetime.now(timezone.utc):
+            db.set_session(key, {"user_id": data["user_id"], "created_at": data["created_at"]})
+
+    if _session_expires_at(data["created_at"]) <= datetime.now(timezone.utc):
+        return None
+    _remember_session(key, data["user_id"], data["created_at"])
+    return data["user_id"]
+
+
+def revoke_session(db, token):
+    key = session_key(token)
+    session_cache.pop(key)
+    db.delete_session(key)
+
+
+def cleanup_expired_sessions(db, now=None) -> int:
+    # created_at が期限を過ぎたセッションをまとめて削除する
+    now = now or datetime.now(timezone.utc)
+    return db.delete_sessions_before(now - SESSION_TTL)
+
+
+_cleanup_lock = threading.Lock()
+_last_cleanup = None
+
+def maybe_cleanup_expired_sessions(db):
+    # ログインのたびには走らせず、プロセスごとに一定間隔でだけ実行する
+    global _last_cleanup
+    with _cleanup_lock:
+        now = time.monotonic()
+        if _last_cleanup is not None and now - _last_cleanup < SESSION_CLEANUP_INTERVAL:
+            return
+        _last_cleanup = now
+    # 件数が多いとログインを待たせるのでバックグラウンドで消す
+    threading.Thread(target=cleanup_expired_sessions, args=(db,), daemon=True).start()
@@ -0,0 +1,38 @@
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from backends import FirestoreBackend, SQLiteBackend  # noqa: E402
+from benchmarks.fake_firestore import FakeFirestore  # noqa: E402
+from catalog_registry import CatalogRegistry  # noqa: E402
+
+WORKBOOK = ROOT / "skillcheck_ver5.00_simple.xlsx"
+
+
+@pytest.fixture
+def catalog_dir(tmp_path):
+    # 元のワークブック（5.00）だけを置いたカタログのディレクトリ
+    shutil.copy(WORKBOOK, tmp_path)
+    return tmp_path
+
+
+@pytest.fixture
+def registry(catalog_dir):
+    registry = CatalogRegistry(str(catalog_dir))
+    registry.refresh()
+    return registry
+
+
+@pytest.fixture(params=["sqlite", "firestore"])
+def db(request, tmp_path):
+    if request.param == "sqlite":
+        backend = SQLiteBackend(str(tmp_path / "answers.db"))
+        yield backend
+        backend.close()
+    else:
+        yield FirestoreBackend(FakeFirestore())
@@ -0,0 +1,55 @@
+"""組織の回答行列のバックグラウンド構築。"""
+import threading
+
+import pytest
+
+import analytics
+import storage
+
+SHEET = "ビジネス力"
+
+
+@pytest.fixture(autouse=True)
+def reset_matrix():
+    analytics._matrix = None
+    yield
+    if analytics._building is not None:
+        analytics._building[0].join()
+    analytics._matrix = None
+
+
+def test_latest_org_matrix_does_not_wait_for_build(db, registry):
+    active = registry.active
+    storage.commit_changes(db, [("u1", SHEET, {"1": True})], active, remember=False)
+
+    assert analytics.latest_org_matrix(db, active) is None
+    analytics._building[0].join()
+    matrix = analytics.latest_org_matrix(db, active)
+    assert matrix.user_ids == ["u1"]
+
+    # 古くなっても手元の行列を返し、作り直しは裏で行う
+    assert analytics.latest_org_matrix(db, active, max_age=0) is matrix
+    analytics._building[0].join()
+    assert analytics.latest_org_matrix(db, active) is not matrix
+
+
+def test_saves_during_build_are_replayed(db, registry, monkeypatch):
+    active = registry.active
+    started, release = threading.Event(), threading.Event()
+    build = analytics.build_org_matrix
+
+    def slow_build(db, catalog_version):
+        matrix = build(db, catalog_version)
+        started.set()
+        release.wait(5)
+        return matrix
+
+    monkeypatch.setattr(analytics, "build_org_matrix", slow_build)
+    analytics.refresh_async(db, active)
+    started.wait(5)
+    storage.commit_changes(db, [("u2", SHEET, {"1": True})], active, remember=False)
+    release.set()
+
+    matrix = analytics.get_org_matrix(db, active)
+    assert matrix.user_ids == ["u2"]
+    assert matrix.stats().user_count == 1
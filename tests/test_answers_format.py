@@ -0,0 +1,200 @@
+"""回答のビット列形式（SheetAnswers）、版の読み替え、保存時の項目単位のマージ。"""
+import pandas as pd
+import pytest
+
+import catalog
+import storage
+from backends import FirestoreBackend
+from benchmarks.fake_firestore import FakeFirestore
+from catalog_registry import CatalogRegistry, UnknownCatalogVersion, build_remap
+from scoring import SheetAnswers, get_index
+
+SHEET = "ビジネス力"
+
+
+def write_version(catalog_dir, registry, version, edit):
+    with pd.ExcelWriter(catalog_dir / f"skillcheck_ver{version}_simple.xlsx") as writer:
+        for sheet in catalog.SHEETS:
+            df = edit(registry.active.catalog.frame(sheet).copy())
+            df["必須"] = df["必須"].map({True: 1, False: None})
+            df.to_excel(writer, sheet_name=sheet, startrow=2, index=False)
+
+
+def reverse_items(df):
+    # 項目の並びを逆にして NO を振り直す（同じ項目の NO は n + 1 - 旧NO になる）
+    df = df.iloc[::-1].copy()
+    df["NO"] = range(1, len(df) + 1)
+    return df
+
+
+def write_reversed_version(catalog_dir, registry, version="6.00"):
+    write_version(catalog_dir, registry, version, reverse_items)
+
+
+# --- SheetAnswers ---
+def test_sheet_answers_round_trip(registry):
+    si = get_index(registry.active.catalog)[SHEET]
+    answers = SheetAnswers.from_dict(si, {"1": True, "2": False, "3": True, "no-such-item": True})
+
+    assert len(answers.to_bytes()) == (si.size + 7) // 8
+    restored = SheetAnswers.from_bytes(si, answers.to_bytes())
+    assert restored.achieved_keys() == ["1", "3"]
+    assert dict(restored) == dict(answers)
+    assert restored["1"] and not restored["2"]
+    assert restored.lookup(["3", "2", "no-such-item"]).tolist() == [True, False, False]
+
+
+def test_sheet_answers_updated_returns_new_instance(registry):
+    si = get_index(registry.active.catalog)[SHEET]
+    answers = SheetAnswers.from_dict(si, {"1": True})
+
+    updated = answers.updated({"1": False, "4": True})
+    assert updated.achieved_keys() == ["4"]
+    assert answers.achieved_keys() == ["1"]
+
+
+def test_sheet_answers_rejects_wrong_length(registry):
+    si = get_index(registry.active.catalog)[SHEET]
+    with pytest.raises(ValueError):
+        SheetAnswers.from_bytes(si, b"\x00" * ((si.size + 7) // 8 + 1))
+
+
+# --- 版の読み替え ---
+def test_build_remap_follows_renumbered_items(catalog_dir, registry):
+    old = registry.active.catalog
+    write_reversed_version(catalog_dir, registry)
+    assert registry.refresh()
+    new = registry.active.catalog
+
+    n = len(old.sheet(SHEET))
+    remap = build_remap(old.sheet(SHEET), new.sheet(SHEET))
+    assert len(remap) == n
+    assert all(remap[str(no)] == str(n + 1 - no) for no in range(1, n + 1))
+
+
+def test_decode_answers_upgrades_old_versions(catalog_dir, registry):
+    v5 = registry.active
+    si5 = get_index(v5.catalog)[SHEET]
+    write_reversed_version(catalog_dir, registry)
+    registry.refresh()
+    v6 = registry.active
+    n = len(v5.catalog.sheet(SHEET))
+
+    expected = [str(n - 2), str(n)]
+    legacy = {"user_id": "u", "sheet": SHEET, "answers": {"1": True, "2": False, "3": True}}
+    old_bits = {"user_id": "u", "sheet": SHEET, "catalog_version": "5.00",
+                "bits": SheetAnswers.from_dict(si5, {"1": True, "3": True}).to_bytes()}
+    assert v6.decode_answers(legacy).achieved_keys() == expected
+    assert v6.decode_answers(old_bits).achieved_keys() == expected
+
+    # 同じ版のビット列はそのまま、取得済みの旧い版のオブジェクトは旧い版の NO で読める
+    current = {"user_id": "u", "sheet": SHEET, "catalog_version": "6.00",
+               "bits": SheetAnswers.from_dict(get_index(v6.catalog)[SHEET], {"1": True}).to_bytes()}
+    assert v6.decode_answers(current).achieved_keys() == ["1"]
+    assert v5.decode_answers(old_bits).achieved_keys() == ["1", "3"]
+
+    unknown = {"user_id": "u", "sheet": SHEET, "catalog_version": "9.99", "bits": b"\xff"}
+    assert v6.decode_answers(unknown).achieved_keys() == []
+
+
+def test_removed_workbook_stays_decodable(catalog_dir, registry, db):
+    v5 = registry.active
+    storage.commit_changes(db, [("u", SHEET, {"1": True, "2": True, "3": True})], v5, remember=False)
+    n = len(v5.catalog.sheet(SHEET))
+
+    # 5.00 のワークブックを 6.00 に置き換える（別のプロセスのレジストリでも読める）
+    write_reversed_version(catalog_dir, registry)
+    (catalog_dir / "skillcheck_ver5.00_simple.xlsx").unlink()
+    registry.refresh()
+    v6 = registry.active
+    storage.commit_changes(db, [("u", SHEET, {"4": True})], v6, remember=False)
+
+    fresh = CatalogRegistry(str(catalog_dir))
+    fresh.refresh()
+    stored = db.get_answers([("u", SHEET)])[("u", SHEET)]
+    assert fresh.active.decode_answers(stored).achieved_keys() == ["4", str(n - 2), str(n - 1), str(n)]
+    legacy = {"user_id": "u", "sheet": SHEET, "answers": {"1": True}}
+    assert fresh.active.decode_answers(legacy).achieved_keys() == [str(n)]
+
+
+def test_undecodable_answers_are_not_overwritten(registry, db):
+    active = registry.active
+    si = get_index(active.catalog)[SHEET]
+    original = {"user_id": "u", "sheet": SHEET, "catalog_version": "9.99",
+                "bits": SheetAnswers.from_dict(si, {"1": True}).to_bytes()}
+    db.write_answers([("u", SHEET, original, False)])
+
+    assert active.decode_answers(original).achieved_keys() == []
+    with pytest.raises(UnknownCatalogVersion):
+        storage.commit_changes(db, [("u", SHEET, {"4": True})], active, remember=False)
+    assert db.get_answers([("u", SHEET)])[("u", SHEET)]["bits"] == original["bits"]
+
+    # 書き込み待ちのキューは読めないドキュメントの変更だけを捨て、ほかは書き込む
+    queue = storage.WriteBehindQueue(db, delay=60)
+    queue.enqueue("u", SHEET, {"4": True}, active)
+    queue.enqueue("v", SHEET, {"4": True}, active)
+    queue.flush()
+    assert queue._pending == {}
+    stored = db.get_answers([("u", SHEET), ("v", SHEET)])
+    assert stored["u", SHEET]["bits"] == original["bits"]
+    assert active.decode_answers(stored["v", SHEET]).achieved_keys() == ["4"]
+
+
+def test_same_version_edit_keeps_bit_layout(catalog_dir, registry):
+    v5 = registry.active
+    bits = {"user_id": "u", "sheet": SHEET, "catalog_version": "5.00",
+            "bits": SheetAnswers.from_dict(get_index(v5.catalog)[SHEET], {"1": True}).to_bytes()}
+
+    # 項目を減らす上書きは取り込まない
+    write_version(catalog_dir, registry, "5.00", lambda df: df.iloc[:-1])
+    assert not registry.refresh()
+    assert registry.active is v5
+    assert registry.active.decode_answers(bits).achieved_keys() == ["1"]
+
+    # 項目文の修正だけなら取り込む
+    def fix_text(df):
+        df["チェック項目"] = df["チェック項目"] + "。"
+        return df
+
+    write_version(catalog_dir, registry, "5.00", fix_text)
+    assert registry.refresh()
+    assert registry.active.catalog is not v5.catalog
+    assert registry.active.decode_answers(bits).achieved_keys() == ["1"]
+
+
+# --- 保存（他のセッションの保存を消さない） ---
+def test_save_merges_into_latest_stored_answers(db, registry):
+    active = registry.active
+    storage.answers_cache.clear()
+    storage.save_user_answers(db, "u", SHEET, {"1": True}, active)
+    storage.fetch_user_answers(db, "u", [SHEET], active)  # このプロセスのキャッシュ（以後古くなる）
+
+    # 別のプロセスが同じドキュメントに保存する
+    storage.commit_changes(db, [("u", SHEET, {"2": True})], active, remember=False)
+    storage.save_user_answers(db, "u", SHEET, {"1": True, "3": True}, active)
+
+    stored = active.decode_answers(db.get_answers([("u", SHEET)])[("u", SHEET)])
+    assert stored.achieved_keys() == ["1", "2", "3"]
+    storage.answers_cache.clear()
+
+
+def test_firestore_update_retries_on_conflict(registry):
+    client = FakeFirestore()
+    db = FirestoreBackend(client)
+    active = registry.active
+    calls = []
+
+    def update(user_id, sheet, data):
+        calls.append(data)
+        if len(calls) == 1:
+            # 読み込みからコミットまでの間に別のプロセスが書き込む
+            db.write_answers([(user_id, sheet, *storage.answers_document(
+                user_id, sheet, SheetAnswers.from_dict(get_index(active.catalog)[sheet], {"2": True}), active))])
+        answers = storage.doc_answers(data or {"user_id": user_id, "sheet": sheet}, active)
+        return storage.answers_document(user_id, sheet, answers.updated({"1": True}), active)
+
+    db.update_answers([("u", SHEET)], update)
+
+    assert len(calls) == 2 and calls[0] is None
+    stored = active.decode_answers(db.get_answers([("u", SHEET)])[("u", SHEET)])
+    assert stored.achieved_keys() == ["1", "2"]
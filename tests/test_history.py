@@ -0,0 +1,55 @@
+"""回答の変更履歴（チェックポイント + 差分）の読み込みと、任意の時点の状態の復元。"""
+import time
+from datetime import datetime, timedelta, timezone
+
+import bulk_tool
+import history
+import storage
+
+SHEET = "ビジネス力"
+T0 = datetime(2024, 4, 1, 9, 0, tzinfo=timezone.utc)
+
+
+def entry(minutes, flipped, achieved=None):
+    e = {"user_id": "u", "sheet": SHEET, "at": T0 + timedelta(minutes=minutes), "catalog_version": "5.00",
+         "checkpoint": achieved is not None, "flipped": flipped}
+    if achieved is not None:
+        e["achieved"] = achieved
+    return e
+
+
+def test_get_history_starts_at_latest_checkpoint(db):
+    db.append_history([entry(0, ["1"], ["1"]), entry(10, ["2"]), entry(20, ["3"], ["1", "2", "3"]),
+                       entry(30, ["1"])], [])
+    db.append_history([{**entry(5, ["9"], ["9"]), "sheet": "データサイエンス力"}], [])
+
+    assert [e["flipped"] for e in db.get_history("u", SHEET)] == [["3"], ["1"]]
+    assert [e["flipped"] for e in db.get_history("u", SHEET, until=T0 + timedelta(minutes=15))] == [["1"], ["2"]]
+    assert db.get_history("u", SHEET, until=T0 - timedelta(minutes=1)) == []
+
+
+def test_state_at_replays_changes_after_save(db, registry):
+    active = registry.active
+    storage.answers_cache.clear()
+    history._checkpoints.clear()
+    storage.save_user_answers(db, "u", SHEET, {"1": True, "2": True}, active)
+    time.sleep(0.01)
+    middle = datetime.now(timezone.utc)
+    time.sleep(0.01)
+    storage.save_user_answers(db, "u", SHEET, {"1": False, "3": True}, active)
+
+    assert history.state_at(db, "u", SHEET, active, middle).achieved_keys() == ["1", "2"]
+    assert history.state_at(db, "u", SHEET, active).achieved_keys() == ["2", "3"]
+    assert history.state_at(db, "u", SHEET, active, middle - timedelta(days=1)) is None
+    storage.answers_cache.clear()
+
+
+def test_import_records_history(db, registry):
+    active = registry.active
+    history._checkpoints.clear()
+    bulk_tool.commit_groups(db, {("u", SHEET): {"1": True, "2": True}, ("v", SHEET): {"1": False}}, 2, active)
+    bulk_tool.commit_groups(db, {("u", SHEET): {"1": False, "2": True}}, 2, active)
+
+    assert history.state_at(db, "u", SHEET, active).achieved_keys() == ["2"]
+    assert [e["flipped"] for e in db.get_history("u", SHEET)] == [["1", "2"], ["1"]]
+    assert db.get_history("v", SHEET) == []  # 値の変わらないインポートは記録しない
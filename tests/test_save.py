@@ -0,0 +1,87 @@
+"""回答の保存（変更された項目だけの書き込み）と write-behind キュー。"""
+import pytest
+
+import storage
+
+SHEET = "ビジネス力"
+
+
+@pytest.fixture(autouse=True)
+def clear_answers_cache(monkeypatch):
+    storage.answers_cache.clear()
+    monkeypatch.setattr(storage, "write_behind", None)
+    yield
+    storage.answers_cache.clear()
+
+
+def stored_keys(db, active, user_id="u"):
+    return active.decode_answers(db.get_answers([(user_id, SHEET)])[(user_id, SHEET)]).achieved_keys()
+
+
+def count_updates(db, monkeypatch, fail=0):
+    # update_answers の呼び出しを数える（先頭の fail 回は失敗させる）
+    calls = []
+    update_answers = db.update_answers
+
+    def counted(keys, update):
+        calls.append(list(keys))
+        if len(calls) <= fail:
+            raise ConnectionError("unavailable")
+        return update_answers(keys, update)
+
+    monkeypatch.setattr(db, "update_answers", counted)
+    return calls
+
+
+def test_save_keeps_answers_outside_the_filter(db, registry):
+    active = registry.active
+    storage.save_user_answers(db, "u", SHEET, {"1": True, "2": True}, active)
+
+    # 絞り込みで 2, 3 だけを表示して保存する
+    assert storage.save_user_answers(db, "u", SHEET, {"2": False, "3": True}, active) == 2
+    assert stored_keys(db, active) == ["1", "3"]
+
+
+def test_unchanged_save_does_not_write(db, registry, monkeypatch):
+    active = registry.active
+    storage.save_user_answers(db, "u", SHEET, {"1": True}, active)
+    calls = count_updates(db, monkeypatch)
+
+    # 未回答の項目を未達成のまま保存しても変更なし
+    assert storage.save_user_answers(db, "u", SHEET, {"1": True, "2": False}, active) == 0
+    assert calls == []
+
+
+def test_write_behind_merges_saves(db, registry, monkeypatch):
+    active = registry.active
+    queue = storage.WriteBehindQueue(db, delay=60)
+    monkeypatch.setattr(storage, "write_behind", queue)
+    calls = count_updates(db, monkeypatch)
+
+    assert storage.save_user_answers(db, "u", SHEET, {"1": True}, active) == 1
+    assert storage.save_user_answers(db, "u", SHEET, {"1": True, "2": True}, active) == 1
+    # 書き込み前でも自分の保存は見える
+    assert storage.fetch_user_answers(db, "u", [SHEET], active)[SHEET].achieved_keys() == ["1", "2"]
+    assert calls == []
+
+    queue.flush()
+    assert calls == [[("u", SHEET)]]
+    assert stored_keys(db, active) == ["1", "2"]
+
+
+def test_write_behind_requeues_failed_commits(db, registry, monkeypatch):
+    active = registry.active
+    queue = storage.WriteBehindQueue(db, delay=60)
+    calls = count_updates(db, monkeypatch, fail=1)
+
+    queue.enqueue("u", SHEET, {"1": True, "2": True}, active)
+    queue.flush()
+    assert len(calls) == 1
+    assert db.get_answers([("u", SHEET)]) == {}
+
+    # 失敗中に来た新しい変更を優先して、まとめて書き直す
+    queue.enqueue("u", SHEET, {"1": False}, active)
+    queue.flush()
+    assert len(calls) == 2
+    assert stored_keys(db, active) == ["2"]
+    assert queue._pending == {}
@@ -0,0 +1,76 @@
+"""ログインセッション（トークン）の発行・検証・失効と、期限切れセッションの削除。"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import storage
+from backends import SESSIONS_COLLECTION, FirestoreBackend
+from benchmarks.fake_firestore import FakeFirestore
+
+
+@pytest.fixture(autouse=True)
+def clear_session_cache(monkeypatch):
+    storage.session_cache.clear()
+    # 発行時の一括削除（バックグラウンド）は走らせない
+    monkeypatch.setattr(storage, "maybe_cleanup_expired_sessions", lambda db: None)
+    yield
+    storage.session_cache.clear()
+
+
+def store_session(db, token, user_id, age):
+    db.set_session(storage.session_key(token), {"user_id": user_id,
+                                                "created_at": datetime.now(timezone.utc) - age})
+
+
+def test_create_validate_revoke(db):
+    token = storage.create_session(db, "u")
+
+    assert storage.validate_session(db, token) == "u"
+    storage.session_cache.clear()
+    assert storage.validate_session(db, token) == "u"  # キャッシュがなくても DB から検証できる
+    assert storage.validate_session(db, "no-such-token") is None
+
+    storage.revoke_session(db, token)
+    assert storage.validate_session(db, token) is None
+    assert db.get_session(storage.session_key(token)) is None
+
+
+def test_session_expires_from_created_at(db):
+    store_session(db, "old", "u", storage.SESSION_TTL + timedelta(minutes=1))
+    store_session(db, "fresh", "v", storage.SESSION_TTL - timedelta(minutes=1))
+
+    assert storage.validate_session(db, "old") is None
+    assert storage.validate_session(db, "fresh") == "v"
+
+
+def test_cache_ttl_is_capped_at_remaining_lifetime(db):
+    store_session(db, "t", "u", storage.SESSION_TTL - timedelta(seconds=30))
+
+    assert storage.validate_session(db, "t") == "u"
+    expires_at, _ = storage.session_cache._data[storage.session_key("t")]
+    assert expires_at - storage.session_cache.clock() <= 30
+
+
+def test_legacy_token_session_is_migrated():
+    client = FakeFirestore()
+    db = FirestoreBackend(client)
+    created_at = datetime.now(timezone.utc) - timedelta(days=1)
+    client.collection(SESSIONS_COLLECTION).document("u").set({"token": "t", "created_at": created_at,
+                                                              "user_id": "u"})
+
+    assert storage.validate_session(db, "t") == "u"
+    assert not client.collection(SESSIONS_COLLECTION).document("u").get().exists
+    assert db.get_session(storage.session_key("t"))["user_id"] == "u"
+    storage.session_cache.clear()
+    assert storage.validate_session(db, "t") == "u"  # 移行後はハッシュのキーで引ける
+
+
+def test_cleanup_deletes_only_expired_sessions(db):
+    for i in range(3):
+        store_session(db, f"old{i}", "u", storage.SESSION_TTL + timedelta(hours=i + 1))
+    store_session(db, "fresh", "v", timedelta(hours=1))
+
+    assert storage.cleanup_expired_sessions(db) == 3
+    assert db.get_session(storage.session_key("old0")) is None
+    assert db.get_session(storage.session_key("fresh")) is not None
+    assert storage.cleanup_expired_sessions(db) == 0